@@ -0,0 +1,45 @@
+import threading
+import time
+
+
+class Cancelled(Exception):
+    """Raised inside a pipeline stage once its job has been cancelled."""
+
+    def __init__(self, message="cancelled"):
+        super().__init__(message)
+
+
+class CancelToken:
+    """
+    Cooperative cancellation flag checked by every pipeline stage between
+    units of work (tiles, frame pairs, encoded frames).
+
+    Besides `cancel()`, an optional `check` callable is polled, at most once
+    per `interval` seconds, for cancellation requested from elsewhere, e.g. a
+    DELETE handled by another uvicorn worker.
+    """
+
+    def __init__(self, check=None, interval=0.5):
+        self._event = threading.Event()
+        self._check = check
+        self._interval = interval
+        self._checked_at = 0.0
+
+    def cancel(self):
+        self._event.set()
+
+    def is_set(self):
+        if self._event.is_set():
+            return True
+        if self._check is not None:
+            now = time.monotonic()
+            if now - self._checked_at >= self._interval:
+                self._checked_at = now
+                if self._check():
+                    self._event.set()
+        return self._event.is_set()
+
+    def raise_if_set(self):
+        if self.is_set():
+            raise Cancelled()
+
@@ -0,0 +1,72 @@
+import json
+import os
+import sqlite3
+import time
+from datetime import datetime, timedelta, timezone
+
+
+def utc(dt):
+    """Aware UTC datetime; naive values are taken to be UTC already."""
+    return dt.replace(tzinfo=timezone.utc) if dt.tzinfo is None else dt.astimezone(timezone.utc)
+
+
+class TimestampCatalog:
+    """
+    Acquisition timestamps that actually exist upstream, per product and UTC
+    day, cached in SQLite so every uvicorn worker shares one listing.
+
+    `list_day(product, day)` returns the aware UTC datetimes available on
+    `day` and raises if the upstream cannot be listed. Listings of days that
+    ended more than `settle` ago are kept for `closed_ttl` seconds, the rest
+    for `ttl` seconds, since late acquisitions still appear for a while.
+    """
+
+    def __init__(self, db_path, list_day, ttl=300.0, closed_ttl=7 * 86400.0, settle=timedelta(hours=6)):
+        self.db_path = str(db_path)
+        self.list_day = list_day
+        self.ttl = ttl
+        self.closed_ttl = closed_ttl
+        self.settle = settle
+        os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS days (
+                    product    TEXT NOT NULL,
+                    day        TEXT NOT NULL,
+                    timestamps TEXT NOT NULL,
+                    fetched_at REAL NOT NULL,
+                    PRIMARY KEY (product, day)
+                )
+            """)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _day(self, product, day):
+        closed = datetime.now(timezone.utc) - datetime(day.year, day.month, day.day, tzinfo=timezone.utc) \
+            > timedelta(days=1) + self.settle
+        ttl = self.closed_ttl if closed else self.ttl
+        with self._connect() as conn:
+            row = conn.execute("SELECT timestamps, fetched_at FROM days WHERE product = ? AND day = ?",
+                               (product, day.isoformat())).fetchone()
+        if row is not None and time.time() - row["fetched_at"] < ttl:
+            return [datetime.fromisoformat(ts) for ts in json.loads(row["timestamps"])]
+
+        timestamps = sorted(utc(ts) for ts in self.list_day(product, day))
+        with self._connect() as conn:
+            conn.execute("INSERT OR REPLACE INTO days VALUES (?, ?, ?, ?)",
+                         (product, day.isoformat(), json.dumps([ts.isoformat() for ts in timestamps]), time.time()))
+        return timestamps
+
+    def available(self, product, start, end):
+        """Sorted timestamps of `product` from `start` to `end` inclusive, over any number of days."""
+        start, end = utc(start), utc(end)
+        found = []
+        day = start.date()
+        while day <= end.date():
+            found += [ts for ts in self._day(product, day) if start <= ts <= end]
+            day += timedelta(days=1)
+        return found
@@ -0,0 +1,53 @@
+import math
+
+# Rough CPU-seconds per unit of work on our CPU nodes; tune against the
+# cloudweave_* stage histograms on /metrics.
+SECONDS_PER_TILE_REQUEST = 0.02         # download, decode and paste of one 256x256 tile
+SECONDS_PER_MEGAPIXEL_INFERENCE = 1.5   # one model.inference call on a 1 MP frame
+SECONDS_PER_MEGAPIXEL_ENCODE = 0.01     # x264 encode of one 1 MP output frame
+SLOT_MINUTES = 30
+
+
+def count_periods(start_dt, end_dt, slot_minutes=SLOT_MINUTES):
+    """Number of acquisition slots from start to end inclusive."""
+    if end_dt < start_dt:
+        return 0
+    return int((end_dt - start_dt).total_seconds() // (slot_minutes * 60)) + 1
+
+
+def estimate_cost(tile_requests_per_frame, periods, exp, mosaic_pixels, frames_per_period=None):
+    """
+    Estimated work for one interpolation request.
+
+    Each period contributes 2**exp output frames, or `frames_per_period`
+    when the output cadence is set directly. `cpu_seconds` is the figure
+    the scheduler admits and orders jobs by; the other fields explain where
+    it comes from.
+    """
+    frames_per_period = frames_per_period or 2 ** exp
+    pairs = max(periods - 1, 0)
+    inference_calls = pairs * (frames_per_period - 1)
+    output_frames = pairs * frames_per_period + (1 if periods else 0)
+    megapixels = mosaic_pixels / 1e6
+
+    fetch = tile_requests_per_frame * periods * SECONDS_PER_TILE_REQUEST
+    inference = inference_calls * megapixels * SECONDS_PER_MEGAPIXEL_INFERENCE
+    encode = output_frames * megapixels * SECONDS_PER_MEGAPIXEL_ENCODE
+    return {
+        "periods": periods,
+        "tile_requests": tile_requests_per_frame * periods,
+        "mosaic_pixels": mosaic_pixels,
+        "inference_calls": inference_calls,
+        "output_frames": output_frames,
+        "cpu_seconds": {
+            "fetch": round(fetch, 2),
+            "inference": round(inference, 2),
+            "encode": round(encode, 2),
+            "total": round(fetch + inference + encode, 2),
+        },
+    }
+
+
+def retry_after_seconds(backlog_cpu_seconds, cores):
+    """Time until `backlog_cpu_seconds` of queued work has drained over `cores` cores."""
+    return max(1, math.ceil(backlog_cpu_seconds / max(cores, 1)))
@@ -0,0 +1,602 @@
+import os
+import math
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+import cv2
+import torch
+import numpy as np
+from torch.nn import functional as F
+from model.pytorch_msssim import ssim_matlab
+from metrics import INFERENCE_PAIR_SECONDS, MODEL_LOAD_SECONDS, timed
+
+DEFAULT_MODEL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'train_log')
+
+# Frame pairs the engine groups into one batched bisection
+PAIRS_PER_BATCH = int(os.environ.get('CLOUDWEAVE_PAIRS_PER_BATCH', '1'))
+
+# Rough peak working set of one IFNet forward pass, in bytes per padded input pixel
+INFERENCE_BYTES_PER_PIXEL = 1536
+
+# Share of the currently free memory one batched forward pass may take, and its size cap
+BATCH_MEMORY_FRACTION = 0.5
+MAX_BATCH = 16
+
+# Context kept around each tile of a frame too large to run whole, in padded pixels; it
+# covers the flow search range, so tile edges see what full-frame inference sees
+TILE_HALO = int(os.environ.get('CLOUDWEAVE_TILE_HALO', '128'))
+
+# Largest padded frame area run in one piece; unset, it is whatever fits in free memory
+TILE_MAX_PIXELS = int(os.environ.get('CLOUDWEAVE_TILE_MAX_PIXELS', '0')) or None
+
+# Memory for the flow-independent context features of recently seen frames
+FEATURE_CACHE_BYTES = int(os.environ.get('CLOUDWEAVE_FEATURE_CACHE_BYTES', str(512 * 1024 ** 2)))
+
+# Weights of the arbitrary-timestep model (IFNet_m); when set, engines render every
+# timestep directly from the endpoints instead of by bisection
+ARBITRARY_MODEL_DIR = os.environ.get('CLOUDWEAVE_ARBITRARY_MODEL_DIR')
+
+device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+
+
+def load_model(model_dir=DEFAULT_MODEL_DIR, arbitrary=False):
+    """Loads RIFE weights from `model_dir`, newest model layout first."""
+    if arbitrary:
+        from model.RIFE import Model
+        model = Model(arbitrary=True)
+        model.load_model(model_dir, -1)
+        print("Loaded arbitrary-timestep RIFE model")
+        model.eval()
+        model.device()
+        return model
+    try:
+        try:
+            try:
+                from model.RIFE_HDv2 import Model
+                model = Model()
+                model.load_model(model_dir, -1)
+                print("Loaded v2.x HD model.")
+            except:
+                from train_log.RIFE_HDv3 import Model
+                model = Model()
+                model.load_model(model_dir, -1)
+                print("Loaded v3.x HD model.")
+        except:
+            from model.RIFE_HD import Model
+            model = Model()
+            model.load_model(model_dir, -1)
+            print("Loaded v1.x HD model")
+    except:
+        from model.RIFE import Model
+        model = Model()
+        model.load_model(model_dir, -1)
+        print("Loaded ArXiv-RIFE model")
+    model.eval()
+    model.device()
+    return model
+
+
+def model_version(model_dir=DEFAULT_MODEL_DIR):
+    """Digest of the weights and model code in `model_dir`, so cached outputs follow model updates."""
+    digest = hashlib.sha256()
+    for name in sorted(os.listdir(model_dir)):
+        if name.endswith(('.pkl', '.py')):
+            digest.update(name.encode())
+            with open(os.path.join(model_dir, name), 'rb') as f:
+                for chunk in iter(lambda: f.read(1 << 20), b''):
+                    digest.update(chunk)
+    return digest.hexdigest()[:16]
+
+
+def to_rgb(frame):
+    if len(frame.shape) == 2 or frame.shape[2] == 1:
+        return cv2.cvtColor(frame, cv2.COLOR_GRAY2RGB)
+    if frame.shape[2] == 4:
+        return cv2.cvtColor(frame, cv2.COLOR_RGBA2RGB)
+    return frame
+
+
+def free_memory():
+    """Bytes the next forward pass could use: free device memory, else the host's MemAvailable."""
+    if torch.cuda.is_available():
+        return torch.cuda.mem_get_info()[0]
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+
+
+def batch_size_for(h, w, fp16=False):
+    """Samples of padded size h x w that fit one forward pass in the memory free right now."""
+    per_sample = h * w * INFERENCE_BYTES_PER_PIXEL // (2 if fp16 else 1)
+    return max(1, min(MAX_BATCH, int(free_memory() * BATCH_MEMORY_FRACTION // per_sample)))
+
+
+class FeatureCache:
+    """
+    Contextnet features of the frames of one run, least recently used
+    dropped first once they take more than `max_bytes`.
+
+    A frame is the right endpoint of one pair, the left endpoint of the next
+    and an endpoint at every timestep or recursion node in between, but its
+    features do not depend on flow and are only computed once. Entries are
+    keyed by what the caller calls the frame, its index within the run, so
+    a cache must not outlive the run whose indices it holds.
+    """
+
+    def __init__(self, model, max_bytes=FEATURE_CACHE_BYTES):
+        self.model = model
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+
+    def get(self, key, img):
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+            return entry[0]
+        features = self.model.context_features(img)
+        size = sum(f.numel() * f.element_size() for f in features)
+        self._entries[key] = (features, size)
+        self._bytes += size
+        while self._bytes > self.max_bytes and len(self._entries) > 1:
+            _, (_, dropped) = self._entries.popitem(last=False)
+            self._bytes -= dropped
+        return features
+
+    def context(self, lefts, rights, keys):
+        """Batched features of both endpoints, `keys[i]` naming lefts[i] and rights[i], as IFNet's `context` expects."""
+        return ([torch.cat(level) for level in zip(*(self.get(k, img) for img, (k, _) in zip(lefts, keys)))],
+                [torch.cat(level) for level in zip(*(self.get(k, img) for img, (_, k) in zip(rights, keys)))])
+
+    def clear(self):
+        self._entries.clear()
+        self._bytes = 0
+
+
+def feature_cache(model):
+    """A FeatureCache for `model`, or None if it cannot take precomputed context features."""
+    return FeatureCache(model) if hasattr(model, 'context_features') else None
+
+
+def _out_of_memory(e):
+    return isinstance(e, RuntimeError) and 'out of memory' in str(e)
+
+
+def infer_batch(model, lefts, rights, scale, batch_size=None, timesteps=None, features=None, keys=None):
+    """
+    Midpoints of every (lefts[i], rights[i]) pair of (1, 3, h, w) tensors,
+    or the frames at `timesteps[i]` for an arbitrary-timestep model, in as
+    few batched forward passes as memory allows; the batch is halved and
+    retried if the device runs out of memory anyway. With a FeatureCache in
+    `features` and the endpoints' cache keys in `keys`, only the
+    flow-dependent part of the context network runs.
+    """
+    h, w = lefts[0].shape[2:]
+    size = batch_size or batch_size_for(h, w, lefts[0].dtype == torch.float16)
+    out = []
+    i = 0
+    while i < len(lefts):
+        kwargs = {}
+        if timesteps is not None:
+            t = torch.tensor(timesteps[i:i + size], device=lefts[0].device, dtype=lefts[0].dtype)
+            kwargs['timestep'] = t.view(-1, 1, 1, 1)
+        try:
+            if features is not None and keys is not None:
+                kwargs['context'] = features.context(lefts[i:i + size], rights[i:i + size], keys[i:i + size])
+            middle = model.inference(torch.cat(lefts[i:i + size]), torch.cat(rights[i:i + size]), scale, **kwargs)
+        except RuntimeError as e:
+            if size == 1 or not _out_of_memory(e):
+                raise
+            if torch.cuda.is_available():
+                torch.cuda.empty_cache()
+            size //= 2
+            continue
+        out += middle.split(1)
+        i += size
+    return out
+
+
+def bisect_batched(model, pairs, scale, batch_size=None, features=None, keys=None):
+    """
+    Intermediates of every (I0, I1, timesteps) pair from midpoint inferences
+    only, returned per pair in the order of its timesteps.
+
+    Each timestep in (0, 1) is snapped to the nearest point of a dyadic grid
+    just fine enough to keep the pair's timesteps apart, so 2**exp - 1 evenly
+    spaced timesteps come out exactly. The grid is filled level by level,
+    and every midpoint needed at one level, across all pairs, goes through
+    `infer_batch` together. `keys[j]`, the cache keys of pair j's
+    endpoints, also name its grid points for the feature cache.
+    """
+    targets, memos, frontier, grids = [], [], [], []
+    for j, (I0, I1, timesteps) in enumerate(pairs):
+        grid = 2 ** max(1, math.ceil(math.log2(len(timesteps) + 1)))
+        grids.append(grid)
+        targets.append([min(grid - 1, max(1, round(t * grid))) for t in timesteps])
+        memos.append({0: I0, grid: I1})
+        if timesteps:
+            frontier.append((j, 0, grid))
+
+    def node(j, k):
+        return keys[j][0] if k == 0 else keys[j][1] if k == grids[j] else (*keys[j], k)
+
+    while frontier:
+        mids = infer_batch(model, [memos[j][lo] for j, lo, _ in frontier],
+                           [memos[j][hi] for j, _, hi in frontier], scale, batch_size, features=features,
+                           keys=[(node(j, lo), node(j, hi)) for j, lo, hi in frontier] if keys else None)
+        below = []
+        for (j, lo, hi), middle in zip(frontier, mids):
+            mid = (lo + hi) // 2
+            memos[j][mid] = middle
+            for a, b in ((lo, mid), (mid, hi)):
+                if any(a < k < b for k in targets[j]):
+                    below.append((j, a, b))
+        frontier = below
+    return [[memo[k] for k in ks] for memo, ks in zip(memos, targets)]
+
+
+def render_batched(model, pairs, scale, batch_size=None, features=None, keys=None):
+    """
+    Intermediates of every (I0, I1, timesteps) pair from an arbitrary-timestep
+    model, each rendered straight from the pair's endpoints at its exact
+    timestep, all of them through `infer_batch` together.
+    """
+    lefts, rights, timesteps, node_keys = [], [], [], []
+    for j, (I0, I1, ts) in enumerate(pairs):
+        lefts += [I0] * len(ts)
+        rights += [I1] * len(ts)
+        timesteps += ts
+        node_keys += [keys[j]] * len(ts) if keys else []
+    out = infer_batch(model, lefts, rights, scale, batch_size, timesteps, features,
+                      node_keys if keys else None) if timesteps else []
+    results = []
+    for _, _, ts in pairs:
+        results.append(out[:len(ts)])
+        out = out[len(ts):]
+    return results
+
+
+def _alignment(scale):
+    return max(32, int(32 / scale))
+
+
+def tile_max_pixels(fp16=False):
+    """Largest padded frame area one forward pass may take, from TILE_MAX_PIXELS or free memory."""
+    if TILE_MAX_PIXELS:
+        return TILE_MAX_PIXELS
+    return int(free_memory() * BATCH_MEMORY_FRACTION // (INFERENCE_BYTES_PER_PIXEL // (2 if fp16 else 1)))
+
+
+def fit_tile(max_pixels, halo=TILE_HALO, align=32):
+    """
+    Side of the square tiles within `max_pixels`, a multiple of `align`, and
+    the halo, shrunk if need be so one aligned core and its halos still fit.
+    """
+    side = int(math.sqrt(max_pixels)) // align * align
+    if side < align:
+        raise ValueError(f"{max_pixels} pixels cannot hold one {align}x{align} tile")
+    return side, min(halo, (side - align) // 2)
+
+
+def _spans(n, side, halo, align):
+    """(crop start, crop end, lead ramp, tail ramp) along an axis of padded length n."""
+    core = side - 2 * halo
+    count = math.ceil(n / core)
+    spans = []
+    for i in range(count):
+        start, end = round(i * n / count), round((i + 1) * n / count)
+        a, b = max(0, start - halo), min(n, end + halo)
+        size = min(n, math.ceil((b - a) / align) * align)
+        a = min(a, n - size)
+        spans.append((a, a + size, a > 0, a + size < n))
+    return spans
+
+
+def tile_boxes(h, w, max_pixels, halo=TILE_HALO, align=32):
+    """
+    Overlapping crops covering a padded h x w frame, each at most
+    `max_pixels` with sides that are multiples of `align`, as (y0, y1, x0,
+    x1, feather) where `feather` flags the edges that ramp into a neighbour.
+    """
+    side, halo = fit_tile(max_pixels, halo, align)
+    rows = _spans(h, side, halo, align) if h > side else [(0, h, False, False)]
+    cols = _spans(w, side, halo, align) if w > side else [(0, w, False, False)]
+    return [(y0, y1, x0, x1, (top, bottom, left, right))
+            for y0, y1, top, bottom in rows for x0, x1, left, right in cols]
+
+
+def _ramp(n, lead, tail, halo, like):
+    # linear over the 2 * halo pixels at an edge shared with a neighbour; blends are
+    # normalised by the summed weights, so wider overlaps from alignment are fine too
+    weight = torch.ones(n, device=like.device, dtype=torch.float32)
+    if halo > 0:
+        ramp = torch.clamp((torch.arange(n, device=like.device, dtype=torch.float32) + 0.5) / (2 * halo), max=1)
+        if lead:
+            weight = torch.minimum(weight, ramp)
+        if tail:
+            weight = torch.minimum(weight, ramp.flip(0))
+    return weight
+
+
+def tiled_batched(model, pairs, scale, max_pixels, halo=TILE_HALO, arbitrary=False, batch_size=None,
+                  features=None, crops=None, keys=None):
+    """
+    Like `interpolate_batched` for frames too large to run whole: each pair
+    is cut into overlapping tiles of at most `max_pixels`, the tiles of
+    every pair go through the model together, batched by tile shape, and
+    each intermediate is put back together with the overlaps feather-blended.
+
+    `crops`, a dict kept between calls of one run, lets a frame shared with
+    the next call reuse its tile tensors by its key in `keys`; each tile is
+    keyed by its frame's key and box for the feature cache.
+    """
+    if crops is None:
+        crops = {}
+    h, w = pairs[0][0].shape[2:]
+    boxes = tile_boxes(h, w, max_pixels, halo, _alignment(scale))
+    _, halo = fit_tile(max_pixels, halo, _alignment(scale))
+
+    def crop(img, key, box):
+        y0, y1, x0, x1, _ = box
+        if key is None:
+            return img[:, :, y0:y1, x0:x1].contiguous()
+        if (key, box[:4]) not in crops:
+            crops[key, box[:4]] = img[:, :, y0:y1, x0:x1].contiguous()
+        return crops[key, box[:4]]
+
+    # edge tiles can come out smaller than the rest, and only tiles of one shape can share a batch
+    shapes = {}
+    for b, (y0, y1, x0, x1, _) in enumerate(boxes):
+        shapes.setdefault((y1 - y0, x1 - x0), []).append(b)
+    tiles = {}
+    for group in shapes.values():
+        tile_pairs, tile_keys = [], []
+        for j, (I0, I1, timesteps) in enumerate(pairs):
+            k0, k1 = keys[j] if keys else (None, None)
+            for b in group:
+                box = boxes[b]
+                tile_pairs.append((crop(I0, k0, box), crop(I1, k1, box), timesteps))
+                tile_keys.append(((k0, box[:4]), (k1, box[:4])))
+        out = interpolate_batched(model, tile_pairs, scale, arbitrary, batch_size, features,
+                                  keys=tile_keys if keys else None)
+        for n, frames in enumerate(out):
+            tiles[n // len(group), group[n % len(group)]] = frames
+
+    results = []
+    for j, (I0, _, timesteps) in enumerate(pairs):
+        frames = []
+        for m in range(len(timesteps)):
+            total = torch.zeros((1, I0.shape[1], h, w), device=I0.device, dtype=torch.float32)
+            weight = torch.zeros((1, 1, h, w), device=I0.device, dtype=torch.float32)
+            for b, (y0, y1, x0, x1, (top, bottom, left, right)) in enumerate(boxes):
+                window = _ramp(y1 - y0, top, bottom, halo, I0)[:, None] * _ramp(x1 - x0, left, right, halo, I0)[None, :]
+                total[:, :, y0:y1, x0:x1] += tiles[j, b][m].float() * window
+                weight[:, :, y0:y1, x0:x1] += window
+            frames.append((total / weight).to(I0.dtype))
+        results.append(frames)
+
+    # only the last frames can come back as the left end of the next call's first pair
+    keep = {k1 for _, k1 in keys} if keys else set()
+    for key in [k for k in crops if k[0] not in keep]:
+        del crops[key]
+    return results
+
+
+def interpolate_batched(model, pairs, scale, arbitrary=False, batch_size=None, features=None,
+                        max_pixels=None, crops=None, keys=None):
+    """
+    Intermediates of every (I0, I1, timesteps) pair, by direct rendering or
+    by bisection; tiled when the padded frames exceed `max_pixels`. Context
+    features are reused from `features` for pairs whose endpoints are named
+    by `keys`, (key of I0, key of I1) per pair, typically frame indices.
+    """
+    if max_pixels is not None and pairs and pairs[0][0].shape[2] * pairs[0][0].shape[3] > max_pixels:
+        return tiled_batched(model, pairs, scale, max_pixels, arbitrary=arbitrary, batch_size=batch_size,
+                             features=features, crops=crops, keys=keys)
+    if arbitrary:
+        return render_batched(model, pairs, scale, batch_size, features, keys)
+    return bisect_batched(model, pairs, scale, batch_size, features, keys)
+
+
+class InterpolationEngine:
+    """
+    Holds one loaded RIFE model for the lifetime of the process.
+
+    Frames go in and come out as RGB uint8 arrays of shape (h, w, 3). Calls
+    from several threads are serialised, since a single model already uses
+    every core it is given.
+    """
+
+    def __init__(self, model_dir=DEFAULT_MODEL_DIR, fp16=False, arbitrary=False):
+        self.model_dir = model_dir
+        self.fp16 = fp16 and torch.cuda.is_available()
+        self.arbitrary = arbitrary
+        if torch.cuda.is_available():
+            torch.backends.cudnn.enabled = True
+            torch.backends.cudnn.benchmark = True
+        load_start = time.time()
+        with torch.no_grad(), timed(MODEL_LOAD_SECONDS):
+            self.model = load_model(model_dir, arbitrary)
+        if self.fp16:
+            self.model.flownet.half()
+        print(f"Model loaded in {time.time() - load_start:.2f} seconds")
+        self.version = model_version(model_dir)
+        self._lock = threading.Lock()
+
+    def _padding(self, h, w, scale):
+        tmp = _alignment(scale)
+        ph = ((h - 1) // tmp + 1) * tmp
+        pw = ((w - 1) // tmp + 1) * tmp
+        return (0, pw - w, 0, ph - h)
+
+    def _to_tensor(self, frame, padding):
+        img = torch.from_numpy(np.transpose(frame, (2, 0, 1))).to(device, non_blocking=True).unsqueeze(0).float() / 255.
+        img = F.pad(img, padding)
+        return img.half() if self.fp16 else img
+
+    def _to_frame(self, img, h, w):
+        return (img[0] * 255.).byte().cpu().numpy().transpose(1, 2, 0)[:h, :w]
+
+    def _static_or_cut(self, I0, I1):
+        I0_small = F.interpolate(I0, (32, 32), mode='bilinear', align_corners=False)
+        I1_small = F.interpolate(I1, (32, 32), mode='bilinear', align_corners=False)
+        ssim = ssim_matlab(I0_small[:, :3].float(), I1_small[:, :3].float())
+        return ssim < 0.2 or ssim > 0.996
+
+    def interpolate_pairs(self, pairs, scale=1.0, keys=None, features=None, crops=None):
+        """
+        Padded intermediate tensors for each (I0, I1, timesteps) of padded
+        tensors, at each fractional timestep in (0, 1), from one batched
+        bisection over all pairs, or one batched rendering of every timestep
+        with an arbitrary-timestep model. Within a run, `keys` name each
+        pair's frames in the run's FeatureCache `features` and tile `crops`.
+        """
+        results = [None] * len(pairs)
+        moving = []
+        with torch.no_grad():
+            for j, (I0, I1, timesteps) in enumerate(pairs):
+                if not timesteps:
+                    results[j] = []
+                elif self._static_or_cut(I0, I1):
+                    # Scene cut or static frame: nothing for the model to move, repeat I0
+                    results[j] = [I0] * len(timesteps)
+                else:
+                    moving.append(j)
+            if moving:
+                with self._lock:
+                    start = time.perf_counter()
+                    mids = interpolate_batched(self.model, [pairs[j] for j in moving], scale, self.arbitrary,
+                                               features=features, max_pixels=tile_max_pixels(self.fp16),
+                                               crops=crops, keys=[keys[j] for j in moving] if keys else None)
+                    elapsed = time.perf_counter() - start
+                for j, pair_mids in zip(moving, mids):
+                    INFERENCE_PAIR_SECONDS.observe(elapsed / len(moving))
+                    results[j] = pair_mids
+        return results
+
+    def interpolate_pair(self, I0, I1, exp=1, scale=1.0):
+        """Return the 2**exp - 1 padded intermediate tensors between two padded tensors."""
+        n = 2 ** exp
+        return self.interpolate_pairs([(I0, I1, [j / n for j in range(1, n)])], scale)[0]
+
+    def interpolate_pair_at(self, I0, I1, timesteps, scale=1.0):
+        """Return padded intermediate tensors at each fractional timestep in (0, 1)."""
+        return self.interpolate_pairs([(I0, I1, timesteps)], scale)[0]
+
+    def _interpolate(self, items, timesteps_for, scale, cancel, pairs_per_batch):
+        items = iter(items)
+        first = next(items, None)
+        if first is None:
+            return
+        t0, lastframe = first
+        lastframe = to_rgb(lastframe)
+        h, w, _ = lastframe.shape
+        padding = self._padding(h, w, scale)
+        I0 = self._to_tensor(lastframe, padding)
+        # this run's frames, by index: each one's context features are computed once for
+        # all the pairs and timesteps it takes part in, and dropped when the run ends
+        features = feature_cache(self.model)
+        crops = {}
+        pending = []
+        try:
+            for n, (t, frame) in enumerate(items, 1):
+                if cancel is not None:
+                    cancel.raise_if_set()
+                frame = to_rgb(frame)
+                I1 = self._to_tensor(frame, padding)
+                pending.append((lastframe, (I0, I1, timesteps_for(t0, t)), (n - 1, n)))
+                t0, lastframe, I0 = t, frame, I1
+                if len(pending) >= pairs_per_batch:
+                    yield from self._flush(pending, h, w, scale, features, crops)
+                    pending = []
+            yield from self._flush(pending, h, w, scale, features, crops)
+            yield lastframe
+        finally:
+            if features is not None:
+                features.clear()
+            crops.clear()
+
+    def _flush(self, pending, h, w, scale, features, crops):
+        mids = self.interpolate_pairs([pair for _, pair, _ in pending], scale,
+                                      [keys for _, _, keys in pending], features, crops)
+        for (frame, _, _), pair_mids in zip(pending, mids):
+            yield frame
+            for mid in pair_mids:
+                yield self._to_frame(mid, h, w)
+
+    def interpolate(self, frames, exp=1, scale=1.0, cancel=None, pairs_per_batch=PAIRS_PER_BATCH):
+        """
+        Yield every input frame followed by its intermediates, in temporal order.
+
+        `frames` may be any iterable, including a generator that is still
+        producing frames; it is consumed lazily, `pairs_per_batch` frame
+        pairs at a time, which are interpolated in one batched bisection. A
+        `cancel` token is checked before every frame pair.
+        """
+        n = 2 ** exp
+        return self._interpolate(enumerate(frames), lambda t0, t1: [j / n for j in range(1, n)],
+                                 scale, cancel, pairs_per_batch)
+
+    def interpolate_timed(self, items, interval, exp=1, scale=1.0, cancel=None, pairs_per_batch=PAIRS_PER_BATCH,
+                          cadence=None):
+        """
+        Like `interpolate`, for (time, frame) pairs that may be unevenly spaced.
+
+        Output frames are `cadence` apart in time, by default `interval /
+        2**exp`: a pair several intervals apart, after missing or dropped
+        frames, gets intermediates at the matching fractional timesteps across
+        the whole gap, so it plays back at the same speed as the rest.
+        `interval` and `cadence` have the type of the difference of two times
+        (timedeltas for datetimes). Cadences that do not divide a gap into a
+        power of two are exact only with an arbitrary-timestep model.
+        """
+        cadence = cadence if cadence is not None else interval / 2 ** exp
+
+        def timesteps_for(t0, t1):
+            steps = max(1, round((t1 - t0) / cadence))
+            return [j / steps for j in range(1, steps)]
+
+        return self._interpolate(items, timesteps_for, scale, cancel, pairs_per_batch)
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_engine(model_dir=DEFAULT_MODEL_DIR):
+    """Process-wide engine, loaded on first use; arbitrary-timestep when ARBITRARY_MODEL_DIR is set."""
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            if ARBITRARY_MODEL_DIR:
+                _engine = InterpolationEngine(ARBITRARY_MODEL_DIR, arbitrary=True)
+            else:
+                _engine = InterpolationEngine(model_dir)
+        return _engine
+
+
+def read_frame(path):
+    """One image file as an RGB array, or None if it cannot be decoded."""
+    frame = cv2.imread(path, cv2.IMREAD_UNCHANGED)
+    if frame is None:
+        return None
+    if len(frame.shape) == 3 and frame.shape[2] == 4:
+        frame = cv2.cvtColor(frame, cv2.COLOR_BGRA2RGB)
+    elif len(frame.shape) == 3:
+        frame = frame[:, :, ::-1].copy()
+    return to_rgb(frame)
+
+
+def read_frames(img_dir):
+    """Yield the numbered PNG frames of a directory as RGB arrays, in order."""
+    names = sorted((f for f in os.listdir(img_dir) if f.endswith('.png')), key=lambda x: int(x[:-4]))
+    for name in names:
+        frame = read_frame(os.path.join(img_dir, name))
+        if frame is not None:
+            yield frame
@@ -0,0 +1,124 @@
+import os
+import subprocess
+import time
+
+from metrics import ENCODE_SECONDS, HLS_FIRST_SEGMENT_SECONDS
+
+# Even dimensions for yuv420p, and a hard alpha cut-off for transparent WMS areas
+VIDEO_FILTER = "scale=ceil(iw/2)*2:ceil(ih/2)*2,lut=a='if(val<50,0,255)'"
+
+
+class FfmpegPipeWriter:
+    """
+    Streams raw RGB frames into a single ffmpeg process.
+
+    One x264 encode feeds both an MP4 file and, when `hls_dir` is given, an
+    HLS playlist with its segments, through ffmpeg's tee muxer. Frames must
+    all share the size of the first one written.
+
+    With `hls_event=True` the playlist is an EVENT playlist that ffmpeg
+    rewrites after every finished segment, so players can start while frames
+    are still being produced; it is closed with #EXT-X-ENDLIST at `close()`.
+    """
+
+    def __init__(self, mp4_path, fps, hls_dir=None, hls_time=10, hls_event=False):
+        self.mp4_path = mp4_path
+        self.fps = fps
+        self.hls_dir = hls_dir
+        self.hls_time = hls_time
+        self.hls_event = hls_event
+        self.frames_written = 0
+        self._proc = None
+        self._size = None
+        self._started_at = None
+        self._hls_published = False
+
+    def _command(self, w, h):
+        cmd = [
+            'ffmpeg', '-y', '-loglevel', 'error',
+            '-f', 'rawvideo',
+            '-pix_fmt', 'rgb24',
+            '-s', f'{w}x{h}',
+            '-framerate', str(self.fps),
+            '-i', '-',
+            '-vf', VIDEO_FILTER,
+            '-c:v', 'libx264',
+            '-pix_fmt', 'yuv420p',
+        ]
+        if self.hls_dir is None:
+            return cmd + [self.mp4_path]
+
+        # Keyframes on segment boundaries so HLS can cut without re-encoding,
+        # and a global header, which the MP4 side of the tee needs
+        cmd += ['-force_key_frames', f'expr:gte(t,n_forced*{self.hls_time})',
+                '-flags', '+global_header', '-map', '0:v']
+        hls_opts = ':'.join([
+            'f=hls',
+            f'hls_time={self.hls_time}',
+            'hls_list_size=0',
+            'start_number=0',
+            'hls_segment_filename=' + os.path.join(self.hls_dir, 'output%d.ts').replace('\\', '/'),
+        ])
+        if self.hls_event:
+            # temp_file: segments and playlist appear atomically, never half-written
+            hls_opts += ':hls_playlist_type=event:hls_flags=independent_segments+temp_file'
+
+        return cmd + ['-f', 'tee', f'[f=mp4]{self.mp4_path}|[{hls_opts}]{self.playlist_path}']
+
+    def _start(self, w, h):
+        if self.hls_dir is not None:
+            os.makedirs(self.hls_dir, exist_ok=True)
+        self._size = (w, h)
+        self._started_at = time.perf_counter()
+        self._proc = subprocess.Popen(
+            self._command(w, h),
+            stdin=subprocess.PIPE,
+            stderr=subprocess.PIPE
+        )
+
+    def write(self, frame):
+        """Write one RGB uint8 frame of shape (h, w, 3)."""
+        h, w, _ = frame.shape
+        if self._proc is None:
+            self._start(w, h)
+        elif (w, h) != self._size:
+            raise ValueError(f"frame size {w}x{h} differs from stream size {self._size[0]}x{self._size[1]}")
+        try:
+            self._proc.stdin.write(frame.tobytes())
+        except BrokenPipeError:
+            raise RuntimeError(f"ffmpeg exited early: {self._proc.stderr.read().decode(errors='replace')}")
+        self.frames_written += 1
+        if self.hls_dir is not None and not self._hls_published and os.path.exists(self.playlist_path):
+            self._hls_published = True
+            HLS_FIRST_SEGMENT_SECONDS.observe(time.perf_counter() - self._started_at)
+
+    def close(self):
+        """Flush ffmpeg and wait for both outputs to be finalised."""
+        if self._proc is None:
+            raise RuntimeError("no frames were written")
+        self._proc.stdin.close()
+        stderr = self._proc.stderr.read().decode(errors='replace')
+        if self._proc.wait() != 0:
+            raise RuntimeError(f"ffmpeg failed: {stderr}")
+        if self.hls_dir is not None and not self._hls_published:
+            # Short videos only publish their playlist once ffmpeg flushes
+            HLS_FIRST_SEGMENT_SECONDS.observe(time.perf_counter() - self._started_at)
+        ENCODE_SECONDS.observe(time.perf_counter() - self._started_at)
+
+    @property
+    def playlist_path(self):
+        return os.path.join(self.hls_dir, 'output.m3u8') if self.hls_dir is not None else None
+
+    def kill(self):
+        if self._proc is not None and self._proc.poll() is None:
+            self._proc.kill()
+            self._proc.wait()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.kill()
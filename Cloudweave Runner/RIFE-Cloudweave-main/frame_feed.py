@@ -0,0 +1,45 @@
+import queue
+
+from cancellation import Cancelled
+
+_END = object()
+
+
+class FrameFeed:
+    """
+    Ordered hand-off of frames from the thread acquiring them to an
+    interpolator iterating the feed in another thread, so frame pair
+    (t, t+1) is interpolated as soon as both frames exist instead of after
+    the whole window has been fetched.
+
+    The producer calls `put` for each frame and `close` once done, passing
+    the exception it failed with, if any; the consumer then raises it.
+    """
+
+    def __init__(self, cancel=None, poll_interval=0.5):
+        self._queue = queue.Queue()
+        self._cancel = cancel
+        self._poll_interval = poll_interval
+        self.frames_in = 0
+
+    def put(self, frame):
+        self.frames_in += 1
+        self._queue.put(frame)
+
+    def close(self, error=None):
+        self._queue.put(_END if error is None else error)
+
+    def __iter__(self):
+        while True:
+            try:
+                item = self._queue.get(timeout=self._poll_interval)
+            except queue.Empty:
+                if self._cancel is not None:
+                    self._cancel.raise_if_set()
+                continue
+            if item is _END:
+                return
+            if isinstance(item, BaseException):
+                # the consumer stops either way; a producer that was closed early reads as cancelled
+                raise item if isinstance(item, Exception) else Cancelled()
+            yield item
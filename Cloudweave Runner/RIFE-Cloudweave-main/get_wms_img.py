@@ -11,10 +11,12 @@ output_format = "image/png"
 # Directory to save the images
 output_directory = "./input_frames"
 
-# Ensure the output directory exists
-os.makedirs(output_directory, exist_ok=True)
+def fetch_images(bbox, width, height, start_time, end_time, output_directory=output_directory, cancel=None,
+                 on_frame=None):
+    # on_frame, if given, is called with each image's path as soon as it is saved
+    # Ensure the output directory exists
+    os.makedirs(output_directory, exist_ok=True)
 
-def fetch_images(bbox, width, height, start_time, end_time):
     # print(start_time, end_time)
 
     labels = {
@@ -51,6 +53,8 @@ def fetch_images(bbox, width, height, start_time, end_time):
     # current_time = formatted_start_time
 
     while start_index < end_index:
+        if cancel is not None:
+            cancel.raise_if_set()
         params = {
             "service": "WMS",
             "version": "1.1.1",
@@ -75,6 +79,8 @@ def fetch_images(bbox, width, height, start_time, end_time):
             filename = os.path.join(output_directory, f"{img_num}.png")
             with open(filename, "wb") as f:
                 f.write(response.content)
+            if on_frame is not None:
+                on_frame(filename)
         # else:
             # print(f"Failed to fetch image for time {start_index}. Status code: {response.status_code}")
 
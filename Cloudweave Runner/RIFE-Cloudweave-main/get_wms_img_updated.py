@@ -1,22 +1,43 @@
 # Cloudweave Runner/RIFE-Cloudweave-main/get_wms_img_updated.py
 
+import io
 import os
-import sys
-import subprocess
 import tempfile
-import requests
+import time
+import uuid
+import re
 import mercantile
-from datetime import datetime, timedelta
+import requests
+import numpy as np
+from datetime import datetime, timedelta, timezone
 from pyproj import Transformer
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from requests.adapters import HTTPAdapter, Retry
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from PIL import Image
 from pathlib import Path
 
-from fastapi import FastAPI, HTTPException, Query
-from fastapi.responses import StreamingResponse
+from fastapi import FastAPI, HTTPException, Query, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import Response, StreamingResponse
 from pydantic import BaseModel
 
+from engine import get_engine
+from frame_feed import FrameFeed
+from ffmpeg_pipe import FfmpegPipeWriter
+from sequencing import sequence_frames
+from singleflight import SingleFlight, flight_key, sse_event
+from cancellation import Cancelled
+from catalog import TimestampCatalog, utc
+from cost import SLOT_MINUTES, count_periods, estimate_cost
+from scheduler import CostScheduler, Saturated
+from tile_cache import TileCache
+from tile_fetcher import CircuitOpen, TileFetcher
+from upstream_limiter import UpstreamLimiter
+from prefetch import Prefetcher
+from video_files import prune_videos
+from metatiles import TILE_SIZE, Block, MetatilePlanner, block_bounds, block_tiles, split_block
+from metrics import (QUEUE_DEPTH, STITCH_SECONDS, TILE_REQUESTS_SAVED, TILE_THROUGHPUT, TILES_FETCHED,
+                     render_latest, tracked)
+
 # ——— CONFIG ——————————————————————————————————————————————
 BASE_URL = (
     "https://mosdac.gov.in/live_data/wms/"
@@ -37,6 +58,43 @@ WMS_PARAMS = {
     "WIDTH": "256",
     "HEIGHT": "256",
 }
+# one HDF5 file per acquisition, listed per day under BASE_URL/<YYYY>/<DDMon>/
+PRODUCT = "3RIMG_L1B_STD"
+PRODUCT_FILE = re.compile(r"3RIMG_(\d{2}[A-Za-z]{3}\d{4})_(\d{4})_L1B_STD_V01R00\.h5")
+VIDEO_FPS = 24
+INTERP_EXP = 1    # one interpolated frame between consecutive timestamps
+# real time between output frames, e.g. 5 for one frame per 5 minutes; replaces INTERP_EXP when set
+OUTPUT_CADENCE = timedelta(minutes=float(os.environ["CLOUDWEAVE_OUTPUT_CADENCE_MINUTES"])) \
+    if "CLOUDWEAVE_OUTPUT_CADENCE_MINUTES" in os.environ else None
+BACKEND_DIR = Path(__file__).parents[2] / "backend"
+VIDEOS_DIR  = BACKEND_DIR / "videos"
+STATE_DIR   = BACKEND_DIR / "state"
+# videos are encoded here and renamed into VIDEOS_DIR once complete, so a
+# half-written file is never served; on the same filesystem as VIDEOS_DIR
+ENCODING_DIR = STATE_DIR / "encoding"
+# finished videos are kept up to this size in total and this age, oldest deleted first
+VIDEOS_MAX_BYTES = int(os.environ.get("CLOUDWEAVE_VIDEOS_MAX_BYTES", str(20 * 1024 ** 3)))
+VIDEOS_MAX_AGE = timedelta(hours=float(os.environ.get("CLOUDWEAVE_VIDEOS_MAX_AGE_HOURS", "168")))
+# mosaic stacks larger than this are backed by a scratch file instead of RAM
+MOSAIC_MEMMAP_BYTES = int(os.environ.get("CLOUDWEAVE_MOSAIC_MEMMAP_BYTES", str(1024 ** 3)))
+# upstream tile requests in flight at once per worker, over one keep-alive pool
+FETCH_CONCURRENCY = int(os.environ.get("CLOUDWEAVE_FETCH_CONCURRENCY", "64"))
+# what MOSDAC gets from all workers together: requests in flight, and started per second
+UPSTREAM_MAX_IN_FLIGHT = int(os.environ.get("CLOUDWEAVE_UPSTREAM_MAX_IN_FLIGHT", "32"))
+UPSTREAM_RATE = float(os.environ.get("CLOUDWEAVE_UPSTREAM_RATE", "50"))
+# failed tiles listed individually in the final event; the count covers the rest
+MAX_REPORTED_FAILURES = 100
+# largest GetMap side in pixels; halved while the server rejects or is slow to render it
+METATILE_MAX_PX = int(os.environ.get("CLOUDWEAVE_METATILE_MAX_PX", "2048"))
+TILE_CACHE_MAX_BYTES = int(os.environ.get("CLOUDWEAVE_TILE_CACHE_MAX_BYTES", str(10 * 1024 ** 3)))
+# a slot's tiles are cached for good once it is this old; younger slots' tiles expire after
+# UNSETTLED_TILE_TTL, so a late or partial upload is fetched again instead of kept forever
+TILE_SETTLE_TIME = timedelta(hours=2)
+UNSETTLED_TILE_TTL = timedelta(minutes=15)
+# how long day listings are trusted while acquisitions may still land, in seconds
+CATALOG_TTL = 300
+# how far back the prefetcher keeps popular regions' slots cached; 0 turns it off
+PREFETCH_LOOKBACK = timedelta(hours=float(os.environ.get("CLOUDWEAVE_PREFETCH_LOOKBACK_HOURS", "6")))
 # Coordinate transformers
 proj_to_merc = Transformer.from_crs("EPSG:4326", "EPSG:3857", always_xy=True)
 proj_to_wgs  = Transformer.from_crs("EPSG:3857", "EPSG:4326", always_xy=True)
@@ -49,10 +107,38 @@ class InterpRequest(BaseModel):
     start_iso:   datetime
     end_iso:     datetime
     zoom:        int = 7
-    max_workers: int = 8
+    max_workers: int = 8    # ignored; FETCH_CONCURRENCY bounds downloads for the whole worker
 
 app = FastAPI()
 
+# identical requests in flight share one pipeline run, across all uvicorn workers
+flights = SingleFlight(STATE_DIR / "inflight")
+
+# pipeline runs start shortest-first against the CPU budget, across all uvicorn workers
+scheduler = CostScheduler(STATE_DIR / "scheduler.sqlite3")
+
+# past tiles never change upstream, so overlapping requests and re-runs reuse them
+tile_cache = TileCache(STATE_DIR / "tiles", TILE_CACHE_MAX_BYTES)
+
+# upstream capacity is shared fairly by every job in every uvicorn worker
+upstream = UpstreamLimiter(STATE_DIR / "upstream.sqlite3",
+                           max_in_flight=UPSTREAM_MAX_IN_FLIGHT, rate=UPSTREAM_RATE)
+fetcher = TileFetcher(concurrency=FETCH_CONCURRENCY, limiter=upstream)
+
+# which slots exist upstream, so absent acquisitions cost no tile requests
+catalog = TimestampCatalog(STATE_DIR / "catalog.sqlite3",
+                           lambda product, day: list_acquisitions(product, day), ttl=CATALOG_TTL)
+
+# tiles are requested as the largest metatiles the server renders promptly
+planner = MetatilePlanner(max_px=METATILE_MAX_PX)
+
+# popular regions' slots are fetched into the tile cache as they are published, while no job is running
+prefetcher = Prefetcher(STATE_DIR / "prefetch.sqlite3",
+                        lambda start, end: acquisition_times(start, end),
+                        lambda region, ts, cancel: warm_slot(region, ts, cancel),
+                        lambda: jobs_active(),
+                        lookback=PREFETCH_LOOKBACK, settle=TILE_SETTLE_TIME, refresh=UNSETTLED_TILE_TTL)
+
 
 def project_bbox(lon_min, lat_min, lon_max, lat_max):
     x0, y0 = proj_to_merc.transform(lon_min, lat_min)
@@ -71,125 +157,350 @@ def tiles_for_bbox(bbox, zoom):
             for y in range(ul.y, lr.y + 1)]
 
 
-def build_tile_request(tile, timestamp):
+def build_request(block, timestamp):
     path = timestamp.strftime("%Y/%d%b/3RIMG_%d%b%Y_%H%M_L1B_STD_V01R00.h5")
     url = BASE_URL + path
-    b = mercantile.xy_bounds(tile)
+    left, bottom, right, top = block_bounds(block)
     params = WMS_PARAMS.copy()
-    params["BBOX"] = f"{b.left},{b.bottom},{b.right},{b.top}"
+    params["BBOX"] = f"{left},{bottom},{right},{top}"
+    params["WIDTH"] = str(TILE_SIZE * block.nx)
+    params["HEIGHT"] = str(TILE_SIZE * block.ny)
     return url, params
 
 
-def create_session_with_retries(total_retries=3, backoff=0.3):
-    session = requests.Session()
-    retry = Retry(
-        total=total_retries,
-        backoff_factor=backoff,
-        status_forcelist=[500,502,503,504],
-        allowed_methods=["GET"]
-    )
-    adapter = HTTPAdapter(max_retries=retry)
-    session.mount("https://", adapter)
-    session.mount("http://", adapter)
-    return session
+def settled(timestamp):
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=timezone.utc)
+    return datetime.now(timezone.utc) - timestamp > TILE_SETTLE_TIME
+
+
+def keep_tiles(block, timestamp, pixels):
+    """Cut a block's pixels back into XYZ tiles for the tile cache."""
+    ttl = None if settled(timestamp) else UNSETTLED_TILE_TTL.total_seconds()
+    for t in block_tiles(block):
+        top, left = (t.y - block.y) * TILE_SIZE, (t.x - block.x) * TILE_SIZE
+        buf = io.BytesIO()
+        Image.fromarray(pixels[top:top + TILE_SIZE, left:left + TILE_SIZE]).save(buf, format="PNG")
+        tile_cache.put(WMS_PARAMS, timestamp, t, buf.getvalue(), ttl)
+
+
+def list_acquisitions(product, day):
+    """Timestamps of the product's files in the day's upstream directory listing."""
+    r = requests.get(BASE_URL + day.strftime("%Y/%d%b/"), timeout=30)
+    r.raise_for_status()
+    return {datetime.strptime(d + hm, "%d%b%Y%H%M") for d, hm in PRODUCT_FILE.findall(r.text)}
+
+
+def acquisition_times(start_dt, end_dt):
+    try:
+        return catalog.available(PRODUCT, start_dt, end_dt)
+    except Exception as e:
+        # listing is down: fall back to the nominal schedule rather than failing the job
+        print(f"Timestamp catalog unavailable ({e}); assuming a slot every {SLOT_MINUTES} minutes")
+        timestamps, current = [], utc(start_dt)
+        while current <= utc(end_dt):
+            timestamps.append(current)
+            current += timedelta(minutes=SLOT_MINUTES)
+        return timestamps
+
+
+def allocate_frames(periods, tiles, scratch_dir):
+    """Zeroed (periods, h, w, 3) uint8 stack for the mosaics; disk-backed when it is large."""
+    xs = {t.x for t in tiles}; ys = {t.y for t in tiles}
+    shape = (periods, 256 * len(ys), 256 * len(xs), 3)
+    if np.prod(shape) > MOSAIC_MEMMAP_BYTES:
+        return np.lib.format.open_memmap(str(scratch_dir / "frames.npy"), mode="w+", dtype=np.uint8, shape=shape)
+    return np.zeros(shape, dtype=np.uint8)
+
+
+def decode_block(block, data, content_type=None):
+    """RGB pixels of a block's image; ValueError if the server sent anything else."""
+    # WMS reports errors as 200 with an XML body
+    if content_type is not None and not content_type.startswith("image/"):
+        raise ValueError(f"not an image: {content_type}")
+    with Image.open(io.BytesIO(data)) as im:
+        pixels = np.asarray(im.convert("RGB"))
+    if pixels.shape[:2] != (TILE_SIZE * block.ny, TILE_SIZE * block.nx):
+        raise ValueError(f"unexpected image size {pixels.shape[1]}x{pixels.shape[0]}")
+    return pixels
+
+
+def paste_block(frame, block, x0, y0, pixels):
+    top, left = (block.y - y0) * TILE_SIZE, (block.x - x0) * TILE_SIZE
+    frame[top:top + pixels.shape[0], left:left + pixels.shape[1]] = pixels
+
+
+def stitch_slots(timestamps, tiles, frames, total_steps, cancel, stats, key, on_slot=None):
+    """
+    Fill `frames` from the tile cache and from metatile GetMaps scheduled
+    for every slot at once, decoding blocks in whatever order they arrive.
+    A rejected block is split and fetched again; tiles that still fail stay
+    black and are listed in `stats["failed"]`, next to the request counts.
+    Each slot is reported as stitched, and handed to `on_slot` with its
+    timestamp, once it and every slot before it are complete.
+    """
+    x0 = min(t.x for t in tiles); y0 = min(t.y for t in tiles)
+    owner = {}
+    missing = [set() for _ in timestamps]
+    failed = [[] for _ in timestamps]
+    remaining = [len(tiles)] * len(timestamps)
+    stitch_time = [0.0] * len(timestamps)
+
+    def submit(k, block):
+        owner[fetcher.submit(*build_request(block, timestamps[k]), job=key)] = (k, block)
+        stats["requests"] += 1
+
+    try:
+        for k, ts in enumerate(timestamps):
+            for t in tiles:
+                cached = tile_cache.get(WMS_PARAMS, ts, t)
+                if cached is not None:
+                    single = Block(t.z, t.x, t.y, 1, 1)
+                    try:
+                        paste_block(frames[k], single, x0, y0, decode_block(single, cached))
+                        remaining[k] -= 1
+                        continue
+                    except (OSError, ValueError):
+                        pass
+                missing[k].add(t)
+            stats["tiles"] += len(missing[k])
+            for block in planner.plan(missing[k]):
+                submit(k, block)
+
+        done = 0
+        slot_start = time.perf_counter()
+        while done < len(timestamps):
+            while done < len(timestamps) and remaining[done] == 0:
+                now = time.perf_counter()
+                TILE_THROUGHPUT.observe(len(tiles) / max(now - slot_start, 1e-6))
+                STITCH_SECONDS.observe(stitch_time[done])
+                slot_start = now
+                if on_slot is not None:
+                    on_slot(timestamps[done], frames[done])
+                done += 1
+                pct = int(done * 2 / total_steps * 100)
+                yield sse_event(progress=pct, message=f"stitched {timestamps[done - 1].strftime('%Y%m%d_%H%M')}",
+                                failed_tiles=len(failed[done - 1]))
+            if done == len(timestamps):
+                break
+
+            finished, _ = wait(owner, timeout=1.0, return_when=FIRST_COMPLETED)
+            if cancel.is_set():
+                raise Cancelled()
+            for fut in finished:
+                k, block = owner.pop(fut)
+                try:
+                    data, content_type, elapsed = fut.result()
+                    start = time.perf_counter()
+                    pixels = decode_block(block, data, content_type)
+                    paste_block(frames[k], block, x0, y0, pixels)
+                    stitch_time[k] += time.perf_counter() - start
+                except Exception as e:
+                    if block.nx * block.ny > 1 and not isinstance(e, CircuitOpen):
+                        # too big for the server, or it choked on it: try again in pieces
+                        print(f"GetMap of {block.nx}x{block.ny} tiles rejected ({e}); splitting")
+                        planner.rejected(block)
+                        for child in split_block(block):
+                            submit(k, child)
+                        continue
+                    TILES_FETCHED.labels("error").inc()
+                    for t in block_tiles(block):
+                        if t in missing[k]:
+                            failed[k].append(t)
+                            stats["failed"].append({"timestamp": timestamps[k].isoformat(),
+                                                    "z": t.z, "x": t.x, "y": t.y, "error": str(e)})
+                else:
+                    planner.observe(block, elapsed)
+                    keep_tiles(block, timestamps[k], pixels)
+                    TILES_FETCHED.labels("ok").inc()
+                # a block may also cover tiles of the slot that came from the cache
+                remaining[k] -= sum(1 for t in block_tiles(block) if t in missing[k])
+    finally:
+        for fut in owner:
+            fut.cancel()
+        TILE_REQUESTS_SAVED.inc(max(stats["tiles"] - stats["requests"], 0))
+
+
+def jobs_active():
+    backlog = scheduler.backlog()
+    return backlog["queued"] + backlog["running"] > 0
+
+
+def warm_slot(region, timestamp, cancel):
+    """Fetch one slot of a (z, x0, y0, x1, y1) region into the tile cache; True if no tile failed."""
+    z, x0, y0, x1, y1 = region
+    tiles = [mercantile.Tile(x, y, z) for x in range(x0, x1 + 1) for y in range(y0, y1 + 1)]
+    stats = {"tiles": 0, "requests": 0, "failed": []}
+    with tempfile.TemporaryDirectory() as tmpdir:
+        frames = allocate_frames(1, tiles, Path(tmpdir))
+        for _ in stitch_slots([timestamp], tiles, frames, 1, cancel, stats, "prefetch"):
+            pass
+    return not stats["failed"]
+
+
+def encode_video(engine, timed_frames, video_path, cancel):
+    # blank and repeated mosaics are skipped and the gaps they leave are
+    # bridged at the nominal cadence, so the video keeps a steady pace
+    frames = sequence_frames(timed_frames)
+    with FfmpegPipeWriter(str(video_path), VIDEO_FPS) as writer:
+        for frame in engine.interpolate_timed(frames, timedelta(minutes=SLOT_MINUTES),
+                                              exp=INTERP_EXP, cancel=cancel, cadence=OUTPUT_CADENCE):
+            writer.write(frame)
 
 
 def process_pipeline(lon_min, lat_min, lon_max, lat_max,
-                     start_dt, end_dt, zoom, max_workers):
-    session = create_session_with_retries()
+                     start_dt, end_dt, zoom, key, cancel):
     bbox    = project_bbox(lon_min, lat_min, lon_max, lat_max)
     tiles   = tiles_for_bbox(bbox, zoom)
 
-    # locate inference script
-    SCRIPT_DIR       = Path(__file__).parent
-    inference_script = SCRIPT_DIR / "inference_video.py"
+    # model weights live next to this script
+    SCRIPT_DIR = Path(__file__).parent
 
-    # calculate total steps
-    periods     = ((end_dt - start_dt).seconds // 1800) + 1
-    total_steps = periods * 2 + 1
-    step        = 0
+    # only slots that were actually acquired, over any number of days
+    timestamps = acquisition_times(start_dt, end_dt)
+    if not timestamps:
+        raise ValueError(f"no acquisitions between {start_dt.isoformat()} and {end_dt.isoformat()}")
+    total_steps = len(timestamps) * 2 + 1
 
     with tempfile.TemporaryDirectory() as tmpdir:
-        base_dir   = Path(tmpdir)
-        tiles_dir  = base_dir / "tiles"
-        stitch_dir = base_dir / "stitched"
-        tiles_dir.mkdir()
-        stitch_dir.mkdir()
-
-        current = start_dt
-        while current <= end_dt:
-            ts = current.strftime("%Y%m%d_%H%M")
-            frame_dir = tiles_dir / ts
-            frame_dir.mkdir(exist_ok=True)
-
-            # parallel downloads
-            with ThreadPoolExecutor(max_workers=max_workers) as ex:
-                futures = {ex.submit(session.get, *build_tile_request(t, current), timeout=30): t for t in tiles}
-                for fut in as_completed(futures):
-                    t = futures[fut]
-                    try:
-                        r = fut.result(); r.raise_for_status()
-                        (frame_dir / f"{t.x}_{t.y}.png").write_bytes(r.content)
-                    except:
-                        pass
+        # write output video to backend/videos, one file per distinct request,
+        # served from there as it is; encode outside it so readers never see a
+        # half-written file
+        video_out = VIDEOS_DIR / f"{key}.mp4"
+        video_tmp = ENCODING_DIR / f"{key}.{uuid.uuid4().hex}.mp4"
+        VIDEOS_DIR.mkdir(parents=True, exist_ok=True)
+        ENCODING_DIR.mkdir(parents=True, exist_ok=True)
+
+        # run inference in-process with this worker's already-loaded model, in a
+        # thread fed each mosaic as soon as it is stitched, so pairs are
+        # interpolated while later slots are still downloading
+        engine = get_engine(str(SCRIPT_DIR / "train_log"))
+        feed   = FrameFeed(cancel)
+        frames = allocate_frames(len(timestamps), tiles, Path(tmpdir))
+        stats  = {"tiles": 0, "requests": 0, "failed": []}
+        try:
+            with ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"encode-{key[:8]}") as pool:
+                encoding = pool.submit(encode_video, engine, feed, video_tmp, cancel)
+                try:
+                    # every download of the window is scheduled at once on the shared fetcher,
+                    # which bounds concurrency; slots are then consumed in order as they land
+                    yield from stitch_slots(timestamps, tiles, frames, total_steps, cancel, stats, key,
+                                            on_slot=lambda ts, frame: feed.put((ts, frame)))
+                except BaseException as e:
+                    feed.close(error=e)
+                    raise
+                feed.close()
+                encoding.result()
+            video_tmp.replace(video_out)
+        finally:
+            video_tmp.unlink(missing_ok=True)
+        prune_videos(VIDEOS_DIR, VIDEOS_MAX_BYTES, VIDEOS_MAX_AGE.total_seconds(), keep=[video_out])
+
+        yield sse_event(progress=100, message="done", video_url=f"/videos/{video_out.name}",
+                        tile_requests=stats["requests"],
+                        tile_requests_saved=max(stats["tiles"] - stats["requests"], 0),
+                        failed_tile_count=len(stats["failed"]),
+                        failed_tiles=stats["failed"][:MAX_REPORTED_FAILURES])
+
+
+def request_key(req: InterpRequest):
+    return flight_key(
+        lon_min=req.lon_min, lat_min=req.lat_min,
+        lon_max=req.lon_max, lat_max=req.lat_max,
+        start=req.start_iso.isoformat(), end=req.end_iso.isoformat(),
+        zoom=req.zoom
+    )
+
+
+def estimate_request(req: InterpRequest):
+    tiles = tiles_for_bbox(project_bbox(req.lon_min, req.lat_min, req.lon_max, req.lat_max), req.zoom)
+    mosaic_pixels = 256 * len({t.x for t in tiles}) * 256 * len({t.y for t in tiles})
+    frames_per_period = round(timedelta(minutes=SLOT_MINUTES) / OUTPUT_CADENCE) if OUTPUT_CADENCE else None
+    return estimate_cost(len(tiles), count_periods(req.start_iso, req.end_iso), INTERP_EXP, mosaic_pixels,
+                         frames_per_period)
+
+
+def admit(req: InterpRequest):
+    """Estimated cost of `req`; 429 with Retry-After when the queue is too long to take it."""
+    estimate = estimate_request(req)
+    if not flights.in_flight(request_key(req)):
+        try:
+            scheduler.check_admission(estimate["cpu_seconds"]["total"])
+        except Saturated as e:
+            raise HTTPException(429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    prefetcher.record(tiles_for_bbox(project_bbox(req.lon_min, req.lat_min, req.lon_max, req.lat_max), req.zoom))
+    return estimate
 
-            # stitch mosaic
-            xs = sorted({t.x for t in tiles}); ys = sorted({t.y for t in tiles})
-            mosaic = Image.new("RGB", (256 * len(xs), 256 * len(ys)))
-            for i, x in enumerate(xs):
-                for j, y in enumerate(ys):
-                    p = frame_dir / f"{x}_{y}.png"
-                    if p.exists(): mosaic.paste(Image.open(p), (i*256, j*256))
-            out_img = stitch_dir / f"{ts}.png"
-            mosaic.save(out_img)
-
-            # send progress
-            step += 2
-            pct  = int(step / total_steps * 100)
-            yield f"data: {{\"progress\":{pct},\"message\":\"stitched {ts}\"}}\n\n"
-
-            current += timedelta(minutes=30)
-
-        # write output video to backend/videos
-        video_out = Path(__file__).parents[2] / "backend" / "videos" / "output.mp4"
-        video_out.parent.mkdir(parents=True, exist_ok=True)
-
-        # run inference
-        subprocess.run([
-            sys.executable,
-            str(inference_script),
-            "--img", str(stitch_dir),
-            "--output", str(video_out),
-            "--model", str(SCRIPT_DIR / "train_log")
-        ], check=True, cwd=str(SCRIPT_DIR))
-
-        # also copy to frontend root so /output.mp4 works
-        FRONTEND_DIR = Path(__file__).parents[2] / "frontend"
-        FRONTEND_DIR.mkdir(parents=True, exist_ok=True)
-        (FRONTEND_DIR / video_out.name).write_bytes(video_out.read_bytes())
-
-        # final SSE with root path
-        yield f"data: {{\"progress\":100,\"message\":\"done\",\"video_url\":\"/{video_out.name}\"}}\n\n"
+
+def scheduled(cost, cancel, events):
+    """Hold `events` back until the scheduler starts this run, and give its budget back afterwards."""
+    ticket = scheduler.enqueue(cost)
+    try:
+        for ahead in scheduler.wait_turn(ticket, cancel):
+            yield sse_event(progress=0, message=f"queued, {ahead} job(s) ahead")
+        yield from events
+    finally:
+        scheduler.release(ticket)
+
+
+def subscribe_pipeline(req: InterpRequest, estimate):
+    """Subscription to the SSE events for `req`, sharing the run of any identical request in flight."""
+    key = request_key(req)
+    return flights.subscribe(key, lambda cancel: scheduled(
+        estimate["cpu_seconds"]["total"], cancel, tracked(process_pipeline(
+            req.lon_min, req.lat_min,
+            req.lon_max, req.lat_max,
+            req.start_iso, req.end_iso,
+            req.zoom, key, cancel
+        ))))
+
+
+async def sse_stream(request: Request, subscription):
+    """Forward a subscription's events; leaving it when the client goes away cancels unshared work."""
+    events = iter(subscription)
+    try:
+        while True:
+            event = await run_in_threadpool(next, events, None)
+            if event is None or await request.is_disconnected():
+                break
+            yield event
+    finally:
+        subscription.close()
+
+# load the model once per worker, before the first request pays for it
+@app.on_event("startup")
+async def _load_engine():
+    await run_in_threadpool(get_engine, str(Path(__file__).parent / "train_log"))
+
+@app.on_event("startup")
+async def _start_prefetcher():
+    if PREFETCH_LOOKBACK:
+        prefetcher.start()
+
+@app.on_event("shutdown")
+async def _close_fetcher():
+    await run_in_threadpool(prefetcher.stop)
+    await run_in_threadpool(fetcher.close)
+
+@app.get("/metrics")
+async def metrics():
+    QUEUE_DEPTH.set((await run_in_threadpool(scheduler.backlog))["queued"])
+    body, content_type = await run_in_threadpool(render_latest)
+    return Response(body, media_type=content_type)
 
 # JSON POST → SSE
 @app.post("/interpolate/stream")
-async def _stream_post(req: InterpRequest):
+async def _stream_post(req: InterpRequest, request: Request):
+    estimate = await run_in_threadpool(admit, req)
     try:
-        return StreamingResponse(
-            process_pipeline(
-                req.lon_min, req.lat_min,
-                req.lon_max, req.lat_max,
-                req.start_iso, req.end_iso,
-                req.zoom, req.max_workers
-            ),
-            media_type="text/event-stream"
-        )
+        return StreamingResponse(sse_stream(request, subscribe_pipeline(req, estimate)), media_type="text/event-stream")
     except Exception as e:
         raise HTTPException(500, detail=str(e))
 
 # SSE GET → SSE
 @app.get("/interpolate/stream")
 async def stream_get(
+    request:     Request,
     lon_min:     float    = Query(...),
     lat_min:     float    = Query(...),
     lon_max:     float    = Query(...),
@@ -199,15 +510,47 @@ async def stream_get(
     zoom:        int      = Query(7),
     max_workers: int      = Query(8),
 ):
+    req = InterpRequest(
+        lon_min=lon_min, lat_min=lat_min,
+        lon_max=lon_max, lat_max=lat_max,
+        start_iso=start_iso, end_iso=end_iso,
+        zoom=zoom, max_workers=max_workers
+    )
+    estimate = await run_in_threadpool(admit, req)
     try:
-        return StreamingResponse(
-            process_pipeline(
-                lon_min, lat_min,
-                lon_max, lat_max,
-                start_iso, end_iso,
-                zoom, max_workers
-            ),
-            media_type="text/event-stream"
-        )
+        return StreamingResponse(sse_stream(request, subscribe_pipeline(req, estimate)), media_type="text/event-stream")
     except Exception as e:
         raise HTTPException(500, detail=str(e))
+
+# dry run: what a request would cost and whether it would be admitted right now
+@app.get("/estimate")
+async def estimate(
+    lon_min:   float    = Query(...),
+    lat_min:   float    = Query(...),
+    lon_max:   float    = Query(...),
+    lat_max:   float    = Query(...),
+    start_iso: datetime = Query(...),
+    end_iso:   datetime = Query(...),
+    zoom:      int      = Query(7),
+):
+    req = InterpRequest(
+        lon_min=lon_min, lat_min=lat_min,
+        lon_max=lon_max, lat_max=lat_max,
+        start_iso=start_iso, end_iso=end_iso,
+        zoom=zoom
+    )
+    estimate = await run_in_threadpool(estimate_request, req)
+    try:
+        backlog = await run_in_threadpool(scheduler.check_admission, estimate["cpu_seconds"]["total"])
+        admission = {"admitted": True, **backlog}
+    except Saturated as e:
+        admission = {"admitted": False, "retry_after": e.retry_after}
+    return {**estimate, "admission": admission}
+
+# cancel a running pipeline for every client attached to it
+@app.delete("/jobs/{job_id}")
+async def cancel_job(job_id: str):
+    if len(job_id) != 32 or not all(c in "0123456789abcdef" for c in job_id) or \
+            not await run_in_threadpool(flights.cancel, job_id):
+        raise HTTPException(404, detail="no running job with this id")
+    return {"job_id": job_id, "status": "cancelling"}
@@ -12,6 +12,8 @@ from model.pytorch_msssim import ssim_matlab
 from get_wms_img import fetch_images
 from datetime import datetime, timedelta
 from translateDataset import TranslateDataset
+from engine import feature_cache, interpolate_batched, load_model, tile_max_pixels
+from sharded import ShardedInterpolator
 
 warnings.filterwarnings("ignore")
 
@@ -78,6 +80,11 @@ parser.add_argument('--fps', dest='fps', type=int, default=None)
 parser.add_argument('--png', dest='png', action='store_true', help='whether to vid_out png format vid_outs')
 parser.add_argument('--ext', dest='ext', type=str, default='mp4', help='vid_out video extension')
 parser.add_argument('--exp', dest='exp', type=int, default=1)
+parser.add_argument('--arbitrary', dest='arbitrary', action='store_true', help='render every timestep straight from the pair with the arbitrary-timestep model (IFNet_m weights in --model)')
+parser.add_argument('--multi', dest='multi', type=int, default=None, help='output frames per input frame, any count; defaults to 2**exp')
+parser.add_argument('--tile', dest='tile', action='store_true', help='run frames too large for free memory as overlapping feather-blended tiles')
+parser.add_argument('--workers', dest='workers', type=int, default=1, help='worker processes, each with its own model on its own share of the cores')
+parser.add_argument('--batch', dest='batch', type=int, default=1, help='frame pairs interpolated together in batched forward passes sized to free memory')
 args = parser.parse_args()
 
 # Fetch the images from the WMS in TIF
@@ -95,6 +102,8 @@ if args.UHD and args.scale==1.0:
 assert args.scale in [0.25, 0.5, 1.0, 2.0, 4.0]
 if not args.img is None:
     args.png = True
+# frames out per frame in; anything but a power of two needs --arbitrary to be exact
+multi = args.multi if args.multi is not None else 2 ** args.exp
 
 device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 torch.set_grad_enabled(False)
@@ -103,30 +112,12 @@ if torch.cuda.is_available():
     torch.backends.cudnn.benchmark = True
     if(args.fp16):
         torch.set_default_tensor_type(torch.cuda.HalfTensor)
-try:
-    try:
-        try:
-            from model.RIFE_HDv2 import Model
-            model = Model()
-            model.load_model(args.modelDir, -1)
-            print("Loaded v2.x HD model.")
-        except:
-            from train_log.RIFE_HDv3 import Model
-            model = Model()
-            model.load_model(args.modelDir, -1)
-            print("Loaded v3.x HD model.")
-    except:
-        from model.RIFE_HD import Model
-        model = Model()
-        model.load_model(args.modelDir, -1)
-        print("Loaded v1.x HD model")
-except:
-    from model.RIFE import Model
-    model = Model()
-    model.load_model(args.modelDir, -1)
-    print("Loaded ArXiv-RIFE model")
-model.eval()
-model.device()
+# forked before this process runs any model itself
+sharded = ShardedInterpolator(args.modelDir, args.workers, args.scale, args.arbitrary, args.tile) if args.workers > 1 else None
+model = load_model(args.modelDir, arbitrary=args.arbitrary)
+# each frame's context features, shared by the batched pairs and timesteps it takes part in
+features = feature_cache(model)
+crops = {} # tiles of the last frame, reused as the left end of the next batch with --tile
 
 if not args.video is None:
     videoCapture = cv2.VideoCapture(args.video)
@@ -135,7 +126,7 @@ if not args.video is None:
     videoCapture.release()
     if args.fps is None:
         fpsNotAssigned = True
-        args.fps = fps * (2 ** args.exp)
+        args.fps = fps * multi
     else:
         fpsNotAssigned = False
     videogen = skvideo.io.vreader(args.video)
@@ -169,7 +160,7 @@ else:
     if args.output is not None:
         vid_out_name = args.output
     else:
-        vid_out_name = '{}_{}X_{}fps.{}'.format(video_path_wo_ext, (2 ** args.exp), int(np.round(args.fps)), args.ext)
+        vid_out_name = '{}_{}X_{}fps.{}'.format(video_path_wo_ext, multi, int(np.round(args.fps)), args.ext)
     vid_out = cv2.VideoWriter(vid_out_name, fourcc, args.fps, (w, h))
 
 def clear_write_buffer(user_args, write_buffer):
@@ -211,6 +202,42 @@ def make_inference(I0, I1, n):
     else:
         return [*first_half, *second_half]
 
+def write_pair(lastframe, output):
+    if args.montage:
+        write_buffer.put(np.concatenate((lastframe, lastframe), 1))
+        for mid in output:
+            mid = (((mid[0] * 255.).byte().cpu().numpy().transpose(1, 2, 0)))
+            write_buffer.put(np.concatenate((lastframe, mid[:h, :w]), 1))
+    else:
+        write_buffer.put(lastframe)
+        for mid in output:
+            mid = (((mid[0] * 255.).byte().cpu().numpy().transpose(1, 2, 0)))
+            write_buffer.put(mid[:h, :w])
+
+def flush_pending(pending):
+    # every pair still needing the model, and every recursion level within them, shares batched forward passes
+    todo = [i for i, (_, _, _, output, _) in enumerate(pending) if output is None]
+    mids = interpolate_batched(model, [(pending[i][1], pending[i][2], [j / multi for j in range(1, multi)]) for i in todo],
+                               args.scale, args.arbitrary, features=features,
+                               max_pixels=tile_max_pixels(args.fp16) if args.tile else None, crops=crops,
+                               keys=[pending[i][4] for i in todo])
+    for i, output in zip(todo, mids):
+        pending[i][3] = output
+    for lastframe, _, _, output, _ in pending:
+        write_pair(lastframe, output)
+    pending.clear()
+
+def drain_sharded(pending, block):
+    # write pairs in order, as far as the workers have finished them
+    while pending:
+        lastframe, _, _, output, _ = pending[0]
+        if isinstance(output, int):
+            if not block and not sharded.ready(output):
+                break
+            output = sharded.get(output)
+        write_pair(lastframe, output)
+        pending.pop(0)
+
 def pad_image(img):
     if(args.fp16):
         return F.pad(img, padding).half()
@@ -234,7 +261,9 @@ _thread.start_new_thread(clear_write_buffer, (args, write_buffer))
 
 I1 = torch.from_numpy(np.transpose(lastframe, (2,0,1))).to(device, non_blocking=True).unsqueeze(0).float() / 255.
 I1 = pad_image(I1)
+I1_no = 0 # index of the tensor in I1 among those fed to the model, its feature cache key
 temp = None # save lastframe when processing static frame
+pending = [] # [lastframe, I0, I1, output; None until inferred, or the workers' sequence number, (I0_no, I1_no)]
 
 while True:
     if temp is not None:
@@ -249,8 +278,10 @@ while True:
     elif frame.shape[2] == 1:  # Single-channel grayscale image
         frame = cv2.cvtColor(frame, cv2.COLOR_GRAY2RGB)
     I0 = I1
+    I0_no = I1_no
     I1 = torch.from_numpy(np.transpose(frame, (2,0,1))).to(device, non_blocking=True).unsqueeze(0).float() / 255.
     I1 = pad_image(I1)
+    I1_no += 1
     I0_small = F.interpolate(I0, (32, 32), mode='bilinear', align_corners=False)
     I1_small = F.interpolate(I1, (32, 32), mode='bilinear', align_corners=False)
     ssim = ssim_matlab(I0_small[:, :3], I1_small[:, :3])
@@ -266,13 +297,14 @@ while True:
         I1 = torch.from_numpy(np.transpose(frame, (2,0,1))).to(device, non_blocking=True).unsqueeze(0).float() / 255.
         I1 = pad_image(I1)
         I1 = model.inference(I0, I1, args.scale)
+        I1_no += 1
         I1_small = F.interpolate(I1, (32, 32), mode='bilinear', align_corners=False)
         ssim = ssim_matlab(I0_small[:, :3], I1_small[:, :3])
         frame = (I1[0] * 255).byte().cpu().numpy().transpose(1, 2, 0)[:h, :w]
     
     if ssim < 0.2:
         output = []
-        for i in range((2 ** args.exp) - 1):
+        for i in range(multi - 1):
             output.append(I0)
         '''
         output = []
@@ -283,24 +315,28 @@ while True:
             beta = 1-alpha
             output.append(torch.from_numpy(np.transpose((cv2.addWeighted(frame[:, :, ::-1], alpha, lastframe[:, :, ::-1], beta, 0)[:, :, ::-1].copy()), (2,0,1))).to(device, non_blocking=True).unsqueeze(0).float() / 255.)
         '''
+    elif sharded is not None or args.batch > 1 or args.arbitrary or args.multi is not None or args.tile:
+        output = None if multi > 1 else []
     else:
         output = make_inference(I0, I1, 2**args.exp-1) if args.exp else []
 
-    if args.montage:
-        write_buffer.put(np.concatenate((lastframe, lastframe), 1))
-        for mid in output:
-            mid = (((mid[0] * 255.).byte().cpu().numpy().transpose(1, 2, 0)))
-            write_buffer.put(np.concatenate((lastframe, mid[:h, :w]), 1))
-    else:
-        write_buffer.put(lastframe)
-        for mid in output:
-            mid = (((mid[0] * 255.).byte().cpu().numpy().transpose(1, 2, 0)))
-            write_buffer.put(mid[:h, :w])
+    if sharded is not None and output is None:
+        output = sharded.submit(I0, I1, [j / multi for j in range(1, multi)], (I0_no, I1_no))
+    pending.append([lastframe, I0, I1, output, (I0_no, I1_no)])
+    if sharded is not None:
+        drain_sharded(pending, block=False)
+    elif len(pending) >= args.batch:
+        flush_pending(pending)
     pbar.update(1)
     lastframe = frame
     if break_flag:
         break
 
+if sharded is not None:
+    drain_sharded(pending, block=True)
+    sharded.close()
+else:
+    flush_pending(pending)
 if args.montage:
     write_buffer.put(np.concatenate((lastframe, lastframe), 1))
 else:
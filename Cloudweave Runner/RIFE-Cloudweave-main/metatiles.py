@@ -0,0 +1,89 @@
+import threading
+from collections import namedtuple
+
+import mercantile
+
+TILE_SIZE = 256
+
+# A rectangle of nx by ny XYZ tiles fetched with one GetMap
+Block = namedtuple("Block", "z x y nx ny")
+
+
+def block_bounds(block):
+    """Web Mercator bounds (left, bottom, right, top) of a block."""
+    ul = mercantile.xy_bounds(mercantile.Tile(block.x, block.y, block.z))
+    lr = mercantile.xy_bounds(mercantile.Tile(block.x + block.nx - 1, block.y + block.ny - 1, block.z))
+    return ul.left, lr.bottom, lr.right, ul.top
+
+
+def block_tiles(block):
+    return [mercantile.Tile(x, y, block.z)
+            for x in range(block.x, block.x + block.nx)
+            for y in range(block.y, block.y + block.ny)]
+
+
+def split_block(block):
+    """Halve a block along each side longer than one tile (up to four children)."""
+    xs = [(block.x, block.nx)] if block.nx == 1 else \
+        [(block.x, block.nx // 2), (block.x + block.nx // 2, block.nx - block.nx // 2)]
+    ys = [(block.y, block.ny)] if block.ny == 1 else \
+        [(block.y, block.ny // 2), (block.y + block.ny // 2, block.ny - block.ny // 2)]
+    return [Block(block.z, x, y, nx, ny) for x, nx in xs for y, ny in ys]
+
+
+class MetatilePlanner:
+    """
+    Covers a set of XYZ tiles with as few large GetMap requests as the WMS
+    server will render promptly.
+
+    Blocks are aligned to a grid of `side` tiles (at most `max_px` pixels
+    per side), so overlapping requests ask the server for the same images.
+    A rejected block (error, non-image or wrong size) is split by the caller
+    with `split_block` and reported through `rejected`; a slow one through
+    `observe`. Either shrinks the side for later plans, and it grows back
+    after `grow_after` prompt answers in a row. The learned side is per
+    process and shared by every pipeline in it.
+    """
+
+    def __init__(self, max_px=2048, slow_seconds=10.0, grow_after=32):
+        self.max_side = 1 << (max(1, max_px // TILE_SIZE).bit_length() - 1)
+        self.slow_seconds = slow_seconds
+        self.grow_after = grow_after
+        self.side = self.max_side
+        self._prompt = 0
+        self._lock = threading.Lock()
+
+    def plan(self, tiles):
+        """Blocks covering `tiles`: per grid cell, the bounding rectangle of the tiles wanted in it."""
+        with self._lock:
+            side = self.side
+        cells = {}
+        for t in tiles:
+            cells.setdefault((t.z, t.x // side, t.y // side), []).append(t)
+        blocks = []
+        for (z, _, _), members in sorted(cells.items()):
+            x0 = min(t.x for t in members); y0 = min(t.y for t in members)
+            x1 = max(t.x for t in members); y1 = max(t.y for t in members)
+            blocks.append(Block(z, x0, y0, x1 - x0 + 1, y1 - y0 + 1))
+        return blocks
+
+    def _shrink(self, block):
+        # powers of two keep the grid aligned across processes that learned different sides
+        half = max(1, max(block.nx, block.ny) // 2)
+        self.side = min(self.side, 1 << (half.bit_length() - 1))
+        self._prompt = 0
+
+    def rejected(self, block):
+        with self._lock:
+            self._shrink(block)
+
+    def observe(self, block, elapsed):
+        """Record how long the server took to render `block`."""
+        with self._lock:
+            if elapsed > self.slow_seconds and max(block.nx, block.ny) > 1:
+                self._shrink(block)
+                return
+            self._prompt += 1
+            if self._prompt >= self.grow_after and self.side < self.max_side:
+                self.side = min(self.max_side, self.side * 2)
+                self._prompt = 0
@@ -0,0 +1,119 @@
+import os
+import resource
+import time
+from contextlib import contextmanager
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram,
+    REGISTRY, generate_latest, multiprocess,
+)
+
+# Under `uvicorn --workers N` set PROMETHEUS_MULTIPROC_DIR so every worker's
+# samples are aggregated into one scrape (see cloudweave.service).
+MULTIPROC = "PROMETHEUS_MULTIPROC_DIR" in os.environ
+
+FAST_BUCKETS  = (.01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30)
+STAGE_BUCKETS = (.1, .25, .5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1200)
+
+TILE_FETCH_SECONDS = Histogram(
+    "cloudweave_tile_fetch_seconds", "Latency of one upstream WMS tile request",
+    buckets=FAST_BUCKETS)
+TILES_FETCHED = Counter(
+    "cloudweave_tiles_fetched_total", "Upstream tile requests by outcome", ["outcome"])
+TILE_HEDGES = Counter(
+    "cloudweave_tile_hedges_total",
+    "Hedged duplicate tile requests sent past the p95, how many won, and how many were skipped "
+    "for want of an upstream slot", ["outcome"])
+UPSTREAM_FAST_FAILS = Counter(
+    "cloudweave_upstream_fast_failures_total", "Requests refused locally while a host's circuit is open",
+    ["host"])
+TILE_REQUESTS_SAVED = Counter(
+    "cloudweave_tile_requests_saved_total", "Per-tile GetMap requests avoided by fetching metatiles")
+TILE_CACHE_LOOKUPS = Counter(
+    "cloudweave_tile_cache_lookups_total", "Tile cache lookups by result", ["result"])
+PREFETCHED_SLOTS = Counter(
+    "cloudweave_prefetched_slots_total", "Hot-region slots the prefetcher tried to warm, by outcome",
+    ["outcome"])
+TILE_THROUGHPUT = Histogram(
+    "cloudweave_tile_throughput_tiles_per_second", "Tiles downloaded per second for one timestamp",
+    buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500, 1000))
+STITCH_SECONDS = Histogram(
+    "cloudweave_stitch_seconds", "Time to stitch one timestamp's tiles into a mosaic",
+    buckets=FAST_BUCKETS)
+MODEL_LOAD_SECONDS = Histogram(
+    "cloudweave_model_load_seconds", "Time to load the interpolation model",
+    buckets=STAGE_BUCKETS)
+FRAMES_DROPPED = Counter(
+    "cloudweave_frames_dropped_total", "Stitched frames skipped before interpolation", ["reason"])
+INFERENCE_PAIR_SECONDS = Histogram(
+    "cloudweave_inference_pair_seconds", "Time to interpolate all intermediates of one frame pair",
+    buckets=FAST_BUCKETS + (60, 120))
+ENCODE_SECONDS = Histogram(
+    "cloudweave_ffmpeg_encode_seconds", "Lifetime of one ffmpeg encode, first frame to finalised output",
+    buckets=STAGE_BUCKETS)
+HLS_FIRST_SEGMENT_SECONDS = Histogram(
+    "cloudweave_hls_first_segment_seconds", "Time from the first frame until the HLS playlist is published",
+    buckets=STAGE_BUCKETS)
+JOB_SECONDS = Histogram(
+    "cloudweave_job_seconds", "End-to-end duration of an interpolation job", ["outcome"],
+    buckets=STAGE_BUCKETS)
+
+# One shared queue, read by whichever worker is scraped, so its latest reading is the depth
+QUEUE_DEPTH = Gauge(
+    "cloudweave_queue_depth", "Jobs waiting to run", multiprocess_mode="mostrecent")
+ACTIVE_JOBS = Gauge(
+    "cloudweave_active_jobs", "Jobs currently running", multiprocess_mode="livesum")
+RESIDENT_MEMORY = Gauge(
+    "cloudweave_resident_memory_bytes", "Resident set size of the serving processes",
+    multiprocess_mode="livesum")
+
+
+@contextmanager
+def timed(histogram):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        histogram.observe(time.perf_counter() - start)
+
+
+@contextmanager
+def track_job():
+    """Count the enclosed block as one active job and record how long it took."""
+    ACTIVE_JOBS.inc()
+    start = time.perf_counter()
+    outcome = "failed"
+    try:
+        yield
+        outcome = "done"
+    finally:
+        ACTIVE_JOBS.dec()
+        JOB_SECONDS.labels(outcome).observe(time.perf_counter() - start)
+        update_resident_memory()
+
+
+def tracked(events):
+    """Wrap a pipeline's event generator so its whole run counts as one job."""
+    with track_job():
+        yield from events
+
+
+def update_resident_memory():
+    try:
+        with open("/proc/self/statm") as f:
+            rss = int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        # No procfs: fall back to the peak, reported in KiB on Linux
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    RESIDENT_MEMORY.set(rss)
+
+
+def render_latest():
+    """Body and content type for a /metrics response."""
+    update_resident_memory()
+    if MULTIPROC:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
@@ -60,7 +60,7 @@ class IFNet_m(nn.Module):
         self.contextnet = Contextnet()
         self.unet = Unet()
 
-    def forward(self, x, scale=[4,2,1], timestep=0.5, returnflow=False):
+    def forward(self, x, scale=[4,2,1], timestep=0.5, returnflow=False, context=None):
         timestep = (x[:, :1].clone() * 0 + 1) * timestep
         img0 = x[:, :3]
         img1 = x[:, 3:6]
@@ -104,8 +104,13 @@ class IFNet_m(nn.Module):
         if returnflow:
             return flow
         else:
-            c0 = self.contextnet(img0, flow[:, :2])
-            c1 = self.contextnet(img1, flow[:, 2:4])
+            if context is None:
+                c0 = self.contextnet(img0, flow[:, :2])
+                c1 = self.contextnet(img1, flow[:, 2:4])
+            else:
+                # Contextnet.features of img0 and img1, computed once per frame by the caller
+                c0 = self.contextnet.warp_features(context[0], flow[:, :2])
+                c1 = self.contextnet.warp_features(context[1], flow[:, 2:4])
             tmp = self.unet(img0, img1, warped_img0, warped_img1, mask, flow, c0, c1)
             res = tmp[:, :3] * 2 - 1
             merged[2] = torch.clamp(merged[2] + res, 0, 1)
@@ -41,20 +41,23 @@ class Contextnet(nn.Module):
         self.conv3 = Conv2(2*c, 4*c)
         self.conv4 = Conv2(4*c, 8*c)
     
+    def features(self, x):
+        # flow-independent part: the same for a frame in every pair and at every timestep
+        x1 = self.conv1(x)
+        x2 = self.conv2(x1)
+        x3 = self.conv3(x2)
+        x4 = self.conv4(x3)
+        return [x1, x2, x3, x4]
+
+    def warp_features(self, features, flow):
+        warped = []
+        for x in features:
+            flow = F.interpolate(flow, scale_factor=0.5, mode="bilinear", align_corners=False, recompute_scale_factor=False) * 0.5
+            warped.append(warp(x, flow))
+        return warped
+
     def forward(self, x, flow):
-        x = self.conv1(x)
-        flow = F.interpolate(flow, scale_factor=0.5, mode="bilinear", align_corners=False, recompute_scale_factor=False) * 0.5
-        f1 = warp(x, flow)        
-        x = self.conv2(x)
-        flow = F.interpolate(flow, scale_factor=0.5, mode="bilinear", align_corners=False, recompute_scale_factor=False) * 0.5
-        f2 = warp(x, flow)
-        x = self.conv3(x)
-        flow = F.interpolate(flow, scale_factor=0.5, mode="bilinear", align_corners=False, recompute_scale_factor=False) * 0.5
-        f3 = warp(x, flow)
-        x = self.conv4(x)
-        flow = F.interpolate(flow, scale_factor=0.5, mode="bilinear", align_corners=False, recompute_scale_factor=False) * 0.5
-        f4 = warp(x, flow)
-        return [f1, f2, f3, f4]
+        return self.warp_features(self.features(x), flow)
     
 class Unet(nn.Module):
     def __init__(self):
@@ -0,0 +1,195 @@
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from cancellation import CancelToken, Cancelled
+from metrics import PREFETCHED_SLOTS
+
+
+class Prefetcher:
+    """
+    Warms the tile cache, off-peak, for the regions users ask for most.
+
+    Each request is recorded as a region, its zoom and tile range, whose
+    score halves every `half_life` seconds. One process at a time, holding
+    a lease in the shared SQLite file, wakes every `interval` seconds and
+    walks the `max_regions` hottest regions scoring at least `min_score`.
+    For every slot listed by `slots(start, end)` within `lookback`, newest
+    first so freshly published slots are ready when users ask for them, it
+    calls `warm(region, timestamp, cancel)`, which returns True once the
+    slot's tiles are all cached. A slot warmed before it was `settle` old is
+    only cached for a while, so it is warmed again after `refresh` until it
+    has settled. Slots go one at a time, and the cancel token trips as soon
+    as `busy()` reports user work, so a burst yields promptly.
+    """
+
+    def __init__(self, db_path, slots, warm, busy, lookback=timedelta(hours=6), settle=timedelta(hours=2),
+                 refresh=timedelta(minutes=15), max_regions=8, min_score=1.5, half_life=6 * 3600.0, interval=60.0, lease_seconds=180.0):
+        self.db_path = str(db_path)
+        self.slots = slots
+        self.warm = warm
+        self.busy = busy
+        self.lookback = lookback
+        self.settle = settle
+        self.refresh = refresh
+        self.max_regions = max_regions
+        self.min_score = min_score
+        self.half_life = half_life
+        self.interval = interval
+        self.lease_seconds = lease_seconds
+        self.owner = uuid.uuid4().hex
+        self._stop = threading.Event()
+        self._thread = None
+        os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS regions (
+                    z          INTEGER NOT NULL,
+                    x0         INTEGER NOT NULL,
+                    y0         INTEGER NOT NULL,
+                    x1         INTEGER NOT NULL,
+                    y1         INTEGER NOT NULL,
+                    score      REAL NOT NULL,
+                    updated_at REAL NOT NULL,
+                    PRIMARY KEY (z, x0, y0, x1, y1)
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS warmed (
+                    z         INTEGER NOT NULL,
+                    x0        INTEGER NOT NULL,
+                    y0        INTEGER NOT NULL,
+                    x1        INTEGER NOT NULL,
+                    y1        INTEGER NOT NULL,
+                    timestamp TEXT NOT NULL,
+                    warmed_at REAL NOT NULL,
+                    PRIMARY KEY (z, x0, y0, x1, y1, timestamp)
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS lease (
+                    id         INTEGER PRIMARY KEY CHECK (id = 1),
+                    owner      TEXT NOT NULL,
+                    expires_at REAL NOT NULL
+                )
+            """)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _decayed(self, score, updated_at, now):
+        return score * 0.5 ** ((now - updated_at) / self.half_life)
+
+    def record(self, tiles):
+        """Count one request for the region covering `tiles`."""
+        z = tiles[0].z
+        region = (z, min(t.x for t in tiles), min(t.y for t in tiles),
+                  max(t.x for t in tiles), max(t.y for t in tiles))
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            now = time.time()
+            row = conn.execute("SELECT score, updated_at FROM regions WHERE z = ? AND x0 = ? AND y0 = ? "
+                               "AND x1 = ? AND y1 = ?", region).fetchone()
+            score = 1.0 if row is None else self._decayed(row["score"], row["updated_at"], now) + 1.0
+            conn.execute("INSERT OR REPLACE INTO regions VALUES (?, ?, ?, ?, ?, ?, ?)", (*region, score, now))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def hot(self):
+        """The regions worth warming, hottest first, as (z, x0, y0, x1, y1)."""
+        now = time.time()
+        with self._connect() as conn:
+            rows = conn.execute("SELECT * FROM regions").fetchall()
+        scored = [(self._decayed(r["score"], r["updated_at"], now), (r["z"], r["x0"], r["y0"], r["x1"], r["y1"]))
+                  for r in rows]
+        scored = [s for s in scored if s[0] >= self.min_score]
+        scored.sort(reverse=True)
+        return [region for _, region in scored[:self.max_regions]]
+
+    def _lead(self):
+        """Take or renew the lease that makes this process the one prefetching."""
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            now = time.time()
+            row = conn.execute("SELECT owner, expires_at FROM lease WHERE id = 1").fetchone()
+            leading = row is None or row["owner"] == self.owner or row["expires_at"] < now
+            if leading:
+                conn.execute("INSERT OR REPLACE INTO lease VALUES (1, ?, ?)", (self.owner, now + self.lease_seconds))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+        return leading
+
+    def _prune(self, now):
+        """Forget slots that left the lookback window and regions nobody asks for anymore."""
+        with self._connect() as conn:
+            conn.execute("DELETE FROM warmed WHERE timestamp < ?", ((now - self.lookback).isoformat(),))
+            for r in conn.execute("SELECT * FROM regions").fetchall():
+                if self._decayed(r["score"], r["updated_at"], time.time()) < 0.01:
+                    conn.execute("DELETE FROM regions WHERE z = ? AND x0 = ? AND y0 = ? AND x1 = ? AND y1 = ?",
+                                 (r["z"], r["x0"], r["y0"], r["x1"], r["y1"]))
+
+    def run_once(self):
+        """One round over the hot regions; returns the number of slots warmed."""
+        now = datetime.now(timezone.utc)
+        self._prune(now)
+        cancel = CancelToken(check=lambda: self._stop.is_set() or self.busy(), interval=1.0)
+        warmed = 0
+        for region in self.hot():
+            with self._connect() as conn:
+                done = {row["timestamp"]: row["warmed_at"] for row in conn.execute(
+                    "SELECT timestamp, warmed_at FROM warmed WHERE z = ? AND x0 = ? AND y0 = ? AND x1 = ? AND y1 = ?",
+                    region)}
+            for ts in sorted(self.slots(now - self.lookback, now), reverse=True):
+                warmed_at = done.get(ts.isoformat())
+                if warmed_at is not None and (warmed_at - ts.timestamp() > self.settle.total_seconds()
+                                              or time.time() - warmed_at < self.refresh.total_seconds()):
+                    continue
+                if cancel.is_set() or not self._lead():
+                    return warmed
+                try:
+                    complete = self.warm(region, ts, cancel)
+                except Cancelled:
+                    PREFETCHED_SLOTS.labels("interrupted").inc()
+                    return warmed
+                if not complete:
+                    PREFETCHED_SLOTS.labels("incomplete").inc()
+                    continue
+                PREFETCHED_SLOTS.labels("warmed").inc()
+                warmed += 1
+                with self._connect() as conn:
+                    conn.execute("INSERT OR REPLACE INTO warmed VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                 (*region, ts.isoformat(), time.time()))
+        return warmed
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                if not self.busy() and self._lead():
+                    self.run_once()
+            except Exception as e:
+                print(f"Prefetch round failed: {e}")
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="prefetch", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=10)
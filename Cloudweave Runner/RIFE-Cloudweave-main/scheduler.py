@@ -0,0 +1,193 @@
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+from cost import retry_after_seconds
+
+# Estimated CPU-seconds of work allowed to run at once, and allowed to wait in the queue;
+# queued jobs start cheapest-first, each waiting second taking AGING_RATE off their cost
+CPU_BUDGET = float(os.environ.get("CLOUDWEAVE_CPU_BUDGET", "1800"))
+MAX_BACKLOG = float(os.environ.get("CLOUDWEAVE_MAX_BACKLOG", "14400"))
+AGING_RATE = 1.0
+
+
+class Saturated(Exception):
+    """Raised at admission when the queued work would take too long to drain."""
+
+    def __init__(self, retry_after):
+        super().__init__(f"scheduler saturated, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+class CostPolicy:
+    """
+    Admission and ordering rules for queues of jobs with an estimated cost
+    in CPU-seconds, kept in one place for every queue that applies them.
+
+    A queued job's priority is its cost minus `aging_rate` for every second
+    it has waited, so large jobs still reach the front eventually. The front
+    job may start only while the estimated cost of everything running stays
+    within `cpu_budget`; a job larger than the whole budget runs once
+    nothing else does. New jobs are turned away while the queued cost would
+    exceed `max_backlog`.
+    """
+
+    def __init__(self, cpu_budget=CPU_BUDGET, max_backlog=MAX_BACKLOG, cores=None, aging_rate=AGING_RATE):
+        self.cpu_budget = cpu_budget
+        self.max_backlog = max_backlog
+        self.cores = cores or os.cpu_count() or 1
+        self.aging_rate = aging_rate
+
+    def order_by(self, now):
+        """ORDER BY clause over `cost` and `created_at` columns, front job first, and its parameters."""
+        return "cost - ? * (? - created_at), created_at", (self.aging_rate, now)
+
+    def fits(self, running, running_cost, cost):
+        """Whether a job of `cost` may start next to `running` jobs of `running_cost`."""
+        return running == 0 or running_cost + cost <= self.cpu_budget
+
+    def admit(self, backlog, cost):
+        """Raise Saturated if a job of `cost` should be turned away from `backlog` for now."""
+        if backlog["queued"] and backlog["queued_cost"] + cost > self.max_backlog:
+            raise Saturated(retry_after_seconds(
+                backlog["queued_cost"] + backlog["running_cost"], self.cores))
+        return backlog
+
+
+class CostScheduler:
+    """
+    Admits pipeline runs by `policy` against a CPU budget shared by every
+    process using the same SQLite file, and starts them in its order.
+
+    Each run holds a ticket carrying its estimated cost in CPU-seconds;
+    only the front ticket may start, once the policy says it fits.
+
+    Tickets are kept alive by a heartbeat from their owning process; those
+    of a process that died are dropped after `lease_seconds`.
+    """
+
+    def __init__(self, db_path, policy=None, poll_interval=0.5, lease_seconds=60.0):
+        self.db_path = str(db_path)
+        self.policy = policy or CostPolicy()
+        self.poll_interval = poll_interval
+        self.lease_seconds = lease_seconds
+        self._owned = set()
+        self._lock = threading.Lock()
+        self._beating = False
+        os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS tickets (
+                    id           TEXT PRIMARY KEY,
+                    cost         REAL NOT NULL,
+                    state        TEXT NOT NULL,
+                    created_at   REAL NOT NULL,
+                    heartbeat_at REAL NOT NULL
+                )
+            """)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _beat(self):
+        while True:
+            time.sleep(self.lease_seconds / 3)
+            with self._lock:
+                owned = list(self._owned)
+            try:
+                with self._connect() as conn:
+                    conn.executemany("UPDATE tickets SET heartbeat_at = ? WHERE id = ?",
+                                     [(time.time(), t) for t in owned])
+                    conn.execute("DELETE FROM tickets WHERE heartbeat_at < ?",
+                                 (time.time() - self.lease_seconds,))
+            except sqlite3.Error as e:
+                print(f"Scheduler heartbeat failed: {e}")
+
+    def backlog(self):
+        """Estimated CPU-seconds and number of tickets, queued and running."""
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT state, COUNT(*) AS n, COALESCE(SUM(cost), 0) AS cost FROM tickets GROUP BY state"
+            ).fetchall()
+        backlog = {"queued": 0, "queued_cost": 0.0, "running": 0, "running_cost": 0.0}
+        for row in rows:
+            backlog[row["state"]] = row["n"]
+            backlog[f"{row['state']}_cost"] = row["cost"]
+        return backlog
+
+    def check_admission(self, cost):
+        """Raise Saturated if a job of `cost` should be turned away for now."""
+        return self.policy.admit(self.backlog(), cost)
+
+    def enqueue(self, cost):
+        """Queue a ticket for a job of `cost` CPU-seconds and return its id."""
+        ticket_id = uuid.uuid4().hex
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO tickets (id, cost, state, created_at, heartbeat_at) VALUES (?, ?, 'queued', ?, ?)",
+                (ticket_id, float(cost), now, now)
+            )
+        with self._lock:
+            self._owned.add(ticket_id)
+            if not self._beating:
+                self._beating = True
+                threading.Thread(target=self._beat, name="scheduler-heartbeat", daemon=True).start()
+        return ticket_id
+
+    def _try_start(self, ticket_id):
+        """Start the ticket if it is its turn; otherwise return how many are ahead of it."""
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            now = time.time()
+            order, params = self.policy.order_by(now)
+            queued = conn.execute(f"SELECT id, cost FROM tickets WHERE state = 'queued' ORDER BY {order}",
+                                  params).fetchall()
+            ahead = next((i for i, row in enumerate(queued) if row["id"] == ticket_id), None)
+            if ahead is None:
+                raise RuntimeError(f"ticket {ticket_id} is not queued")
+            running = conn.execute(
+                "SELECT COUNT(*) AS n, COALESCE(SUM(cost), 0) AS cost FROM tickets WHERE state = 'running'"
+            ).fetchone()
+            fits = self.policy.fits(running["n"], running["cost"], queued[ahead]["cost"])
+            if ahead == 0 and fits:
+                conn.execute("UPDATE tickets SET state = 'running', heartbeat_at = ? WHERE id = ?",
+                             (now, ticket_id))
+            else:
+                conn.execute("UPDATE tickets SET heartbeat_at = ? WHERE id = ?", (now, ticket_id))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+        return None if ahead == 0 and fits else ahead
+
+    def wait_turn(self, ticket_id, cancel=None):
+        """
+        Block until the ticket may run. Yields the number of jobs ahead of it
+        each time that changes, so callers can report queue position.
+        """
+        last = None
+        while True:
+            if cancel is not None:
+                cancel.raise_if_set()
+            ahead = self._try_start(ticket_id)
+            if ahead is None:
+                return
+            if ahead != last:
+                last = ahead
+                yield ahead
+            time.sleep(self.poll_interval)
+
+    def release(self, ticket_id):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM tickets WHERE id = ?", (ticket_id,))
+        with self._lock:
+            self._owned.discard(ticket_id)
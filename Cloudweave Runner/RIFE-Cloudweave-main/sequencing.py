@@ -0,0 +1,49 @@
+import hashlib
+
+import numpy as np
+
+from metrics import FRAMES_DROPPED
+
+# A pixel counts as covered once any channel is above this level
+COVERED_LEVEL = 8
+
+# Frames with less of their area covered than this are empty mosaics (missing
+# acquisitions, transparent WMS areas), not imagery
+MIN_COVERAGE = 0.005
+
+# Coverage is estimated on every n-th row and column
+COVERAGE_STRIDE = 8
+
+
+def fingerprint(frame):
+    """(digest, coverage) of an RGB uint8 frame: exact-content hash and covered share of its area."""
+    digest = hashlib.blake2b(np.ascontiguousarray(frame).data, digest_size=16).hexdigest()
+    sample = frame[::COVERAGE_STRIDE, ::COVERAGE_STRIDE]
+    coverage = np.count_nonzero(sample.max(axis=2) > COVERED_LEVEL) / (sample.shape[0] * sample.shape[1])
+    return digest, coverage
+
+
+def sequence_frames(items, min_coverage=MIN_COVERAGE):
+    """
+    Pass on only the (time, frame) pairs that carry new information.
+
+    Blank frames and exact repeats of the previous kept frame are dropped,
+    so the interpolator spends its model calls on real changes and bridges
+    the resulting gaps from the timestamps instead. Raises ValueError if no
+    frame survives.
+    """
+    last_digest = None
+    kept = 0
+    for t, frame in items:
+        digest, coverage = fingerprint(frame)
+        if coverage < min_coverage:
+            FRAMES_DROPPED.labels("blank").inc()
+            continue
+        if digest == last_digest:
+            FRAMES_DROPPED.labels("duplicate").inc()
+            continue
+        last_digest = digest
+        kept += 1
+        yield t, frame
+    if kept == 0:
+        raise ValueError("every frame was blank")
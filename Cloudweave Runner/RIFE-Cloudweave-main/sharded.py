@@ -0,0 +1,115 @@
+import os
+import queue
+
+import torch
+import torch.multiprocessing as mp
+
+# Pairs handed out per worker before submit() waits for results
+IN_FLIGHT_PER_WORKER = 2
+
+
+def core_sets(workers, cores=None):
+    """Split the cores this process may run on into `workers` disjoint, contiguous sets."""
+    cores = sorted(cores if cores is not None else os.sched_getaffinity(0))
+    if workers > len(cores):
+        raise ValueError(f"{workers} workers need at least as many cores, only {len(cores)} available")
+    return [cores[len(cores) * i // workers:len(cores) * (i + 1) // workers] for i in range(workers)]
+
+
+def _worker(model_dir, arbitrary, scale, tile, cores, tasks, results):
+    os.sched_setaffinity(0, cores)
+    torch.set_num_threads(len(cores))
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        # already fixed by the parent before the fork
+        pass
+    torch.set_grad_enabled(False)
+    from engine import feature_cache, interpolate_batched, load_model, tile_max_pixels
+    model = load_model(model_dir, arbitrary)
+    features = feature_cache(model)
+    while True:
+        task = tasks.get()
+        if task is None:
+            return
+        seq, I0, I1, timesteps, keys = task
+        try:
+            mids = interpolate_batched(model, [(I0, I1, timesteps)], scale, arbitrary, features=features,
+                                       max_pixels=tile_max_pixels() if tile else None,
+                                       keys=[keys] if keys is not None else None)[0]
+        except Exception as e:
+            results.put((seq, None, repr(e)))
+        else:
+            results.put((seq, mids, None))
+
+
+class ShardedInterpolator:
+    """
+    Frame pairs interpolated by `workers` processes, each with its own model
+    replica pinned to a disjoint set of cores and running that many intra-op
+    threads, since one PyTorch process stops scaling after a handful of cores.
+
+    `submit` queues a pair of padded tensors, with their frame indices as
+    feature cache keys, and returns its sequence number; `get` returns a pair's intermediates once they are back, so the
+    caller can write them in order however the workers finish. Workers are
+    forked, so create this before the calling process starts running
+    models itself.
+    """
+
+    def __init__(self, model_dir, workers, scale=1.0, arbitrary=False, tile=False):
+        ctx = mp.get_context('fork')
+        self._tasks = ctx.Queue()
+        self._results = ctx.Queue()
+        self._done = {}
+        self._next_seq = 0
+        self._in_flight = 0
+        self._max_in_flight = workers * IN_FLIGHT_PER_WORKER
+        self._workers = [ctx.Process(target=_worker, args=(model_dir, arbitrary, scale, tile, cores,
+                                                           self._tasks, self._results),
+                                     name=f"interp-{i}", daemon=True)
+                         for i, cores in enumerate(core_sets(workers))]
+        for p in self._workers:
+            p.start()
+
+    def _collect(self, block):
+        """Take in every finished pair; with `block`, wait for at least one."""
+        while True:
+            try:
+                seq, mids, error = self._results.get(timeout=1.0) if block else self._results.get_nowait()
+            except queue.Empty:
+                if not block:
+                    return
+                dead = [p.name for p in self._workers if not p.is_alive()]
+                if dead:
+                    raise RuntimeError(f"interpolation worker(s) {', '.join(dead)} exited")
+                continue
+            self._in_flight -= 1
+            self._done[seq] = (mids, error)
+            block = False
+
+    def submit(self, I0, I1, timesteps, keys=None):
+        while self._in_flight >= self._max_in_flight:
+            self._collect(block=True)
+        seq = self._next_seq
+        self._next_seq += 1
+        self._tasks.put((seq, I0, I1, timesteps, keys))
+        self._in_flight += 1
+        return seq
+
+    def ready(self, seq):
+        self._collect(block=False)
+        return seq in self._done
+
+    def get(self, seq):
+        while seq not in self._done:
+            self._collect(block=True)
+        mids, error = self._done.pop(seq)
+        if error is not None:
+            raise RuntimeError(f"interpolating pair {seq} failed: {error}")
+        return mids
+
+    def close(self):
+        for _ in self._workers:
+            self._tasks.put(None)
+        for p in self._workers:
+            p.join()
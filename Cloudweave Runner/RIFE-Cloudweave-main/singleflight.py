@@ -0,0 +1,243 @@
+import fcntl
+import hashlib
+import json
+import os
+import threading
+import time
+import traceback
+import uuid
+from pathlib import Path
+
+from cancellation import CancelToken, Cancelled
+
+# SSE comment line; marks the end of a flight's event log and is never forwarded
+END_MARKER = ": end"
+
+# SSE comment sent while a flight is quiet, so disconnects are noticed between events
+KEEPALIVE = ": keepalive\n\n"
+
+
+def flight_key(**fields):
+    """Stable key for a request, independent of argument order and formatting."""
+    blob = json.dumps(fields, sort_keys=True, default=str, separators=(",", ":"))
+    return hashlib.sha256(blob.encode()).hexdigest()[:32]
+
+
+def sse_event(**data):
+    return f"data: {json.dumps(data)}\n\n"
+
+
+class Subscription:
+    """One client's view of a flight: iterate for SSE events, `close()` to leave."""
+
+    def __init__(self, key, sub_path, events, leave):
+        self.key = key
+        self._sub_path = sub_path
+        self._events = events
+        self._leave = leave
+        self._closed = threading.Event()
+
+    def __iter__(self):
+        return self._events(self._closed)
+
+    def close(self):
+        """Detach; safe to call from any thread, also while iteration is blocked."""
+        self._closed.set()
+        self._leave()
+
+
+class SingleFlight:
+    """
+    Runs at most one producer per key across every process sharing `registry_dir`.
+
+    The first caller for a key takes an exclusive flock on `<key>.lock` and
+    runs the producer in a background thread, appending each SSE event it
+    yields to `<key>.events`. Every caller, the leader included, tails that
+    log, so later identical requests attach to the running work instead of
+    starting their own. The log, and then the lock file, still under its
+    lock, are removed when the flight lands; whoever locks a lock file
+    checks it is still the one at its path.
+
+    Each attached client holds a file in `<key>.subs/`. The producer is
+    handed a CancelToken that fires once no client is left, or when
+    `cancel(key)` drops a `<key>.cancel` marker. The directory is removed
+    by whichever of the leader and the last client finishes last.
+    """
+
+    def __init__(self, registry_dir, poll_interval=0.25, keepalive_interval=5.0):
+        self.registry_dir = Path(registry_dir)
+        self.registry_dir.mkdir(parents=True, exist_ok=True)
+        self.poll_interval = poll_interval
+        self.keepalive_interval = keepalive_interval
+
+    def _paths(self, key):
+        return self.registry_dir / f"{key}.lock", self.registry_dir / f"{key}.events"
+
+    def _subs_dir(self, key):
+        return self.registry_dir / f"{key}.subs"
+
+    def _cancel_path(self, key):
+        return self.registry_dir / f"{key}.cancel"
+
+    def _try_lock(self, lock_path):
+        fd = os.open(lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return None
+        try:
+            current = os.path.samestat(os.fstat(fd), os.stat(lock_path))
+        except FileNotFoundError:
+            current = False
+        if not current:
+            # a landing leader unlinked the file after we opened it; the next flight uses a new one
+            os.close(fd)
+            return None
+        return fd
+
+    def in_flight(self, key):
+        lock_path, _ = self._paths(key)
+        return lock_path.exists() and not self._leader_gone(lock_path)
+
+    def cancel(self, key):
+        """Ask the flight for `key`, in whichever process runs it, to stop. False if none is running."""
+        if not self.in_flight(key):
+            return False
+        self._cancel_path(key).touch()
+        return True
+
+    def _remove_subs(self, key):
+        try:
+            # Only succeeds once empty; a missing directory reads as abandoned just like an empty one
+            os.rmdir(self._subs_dir(key))
+        except OSError:
+            pass
+
+    def _abandoned(self, key):
+        if self._cancel_path(key).exists():
+            return True
+        try:
+            return not any(self._subs_dir(key).iterdir())
+        except FileNotFoundError:
+            return True
+
+    def _fly(self, key, lock_fd, events_path, producer):
+        cancel = CancelToken(check=lambda: self._abandoned(key))
+        try:
+            with open(events_path, "a") as log:
+                try:
+                    for event in producer(cancel):
+                        log.write(event)
+                        log.flush()
+                except Cancelled:
+                    print(f"Flight {key} cancelled")
+                    log.write(sse_event(progress=100, message="cancelled", error="cancelled"))
+                except Exception as e:
+                    traceback.print_exc()
+                    log.write(sse_event(progress=100, message=f"failed: {e}", error=str(e)))
+                log.write(END_MARKER + "\n\n")
+            # Attached readers keep their open handle; newcomers start a new flight
+            os.unlink(events_path)
+            self._cancel_path(key).unlink(missing_ok=True)
+        finally:
+            self._paths(key)[0].unlink(missing_ok=True)
+            fcntl.flock(lock_fd, fcntl.LOCK_UN)
+            os.close(lock_fd)
+            self._remove_subs(key)
+
+    def subscribe(self, key, producer):
+        """
+        Attach to the flight for `key`, starting one with `producer` if none
+        is in the air. `producer` is called with a CancelToken and returns an
+        iterator of SSE events.
+        """
+        subs_dir = self._subs_dir(key)
+        sub_path = subs_dir / uuid.uuid4().hex
+        while True:
+            subs_dir.mkdir(exist_ok=True)
+            try:
+                sub_path.touch()
+                break
+            except FileNotFoundError:
+                # The last client of a landed flight removed the directory in between
+                continue
+
+        def leave():
+            sub_path.unlink(missing_ok=True)
+            self._remove_subs(key)
+
+        def events(closed):
+            try:
+                yield from self._events(key, producer, closed)
+            finally:
+                leave()
+
+        return Subscription(key, sub_path, events, leave)
+
+    def _events(self, key, producer, closed):
+        lock_path, events_path = self._paths(key)
+        while not closed.is_set():
+            lock_fd = self._try_lock(lock_path)
+            if lock_fd is not None:
+                # Leader: fresh log (a new file, never a truncated stale one),
+                # opened before the work starts so a fast failure cannot unlink it first
+                events_path.unlink(missing_ok=True)
+                self._cancel_path(key).unlink(missing_ok=True)
+                events_path.write_text("")
+                log = open(events_path)
+                threading.Thread(
+                    target=self._fly, args=(key, lock_fd, events_path, producer),
+                    name=f"flight-{key[:8]}", daemon=True
+                ).start()
+                yield sse_event(progress=0, message="started", job_id=key)
+            else:
+                try:
+                    log = open(events_path)
+                except FileNotFoundError:
+                    # Leader is between taking the lock and creating its log, or just landed
+                    time.sleep(self.poll_interval)
+                    continue
+                yield sse_event(progress=0, message="attached to an identical running job", job_id=key)
+            yield from self._tail(log, lock_path, closed)
+            return
+
+    def _tail(self, log, lock_path, closed):
+        buffer = ""
+        quiet_since = time.monotonic()
+        with log:
+            while not closed.is_set():
+                chunk = log.read()
+                if not chunk:
+                    if self._leader_gone(lock_path):
+                        chunk = log.read()
+                        if not chunk:
+                            yield sse_event(progress=100, message="failed: job was lost", error="job was lost")
+                            return
+                    else:
+                        if time.monotonic() - quiet_since >= self.keepalive_interval:
+                            quiet_since = time.monotonic()
+                            yield KEEPALIVE
+                        time.sleep(self.poll_interval)
+                        continue
+                quiet_since = time.monotonic()
+                buffer += chunk
+                while "\n\n" in buffer:
+                    message, buffer = buffer.split("\n\n", 1)
+                    if message == END_MARKER:
+                        return
+                    yield message + "\n\n"
+
+    def _leader_gone(self, lock_path):
+        try:
+            fd = os.open(lock_path, os.O_RDWR)
+        except FileNotFoundError:
+            # removed by the leader as it landed
+            return True
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return False
+        finally:
+            os.close(fd)
+        return True
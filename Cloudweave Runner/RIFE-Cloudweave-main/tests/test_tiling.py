@@ -0,0 +1,71 @@
+import os
+import sys
+
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("cv2")
+pytest.importorskip("prometheus_client")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from engine import fit_tile, interpolate_batched, tile_boxes, tiled_batched
+
+
+def check_boxes(h, w, max_pixels, halo, align):
+    boxes = tile_boxes(h, w, max_pixels, halo, align)
+    rows, cols = set(), set()
+    for y0, y1, x0, x1, _ in boxes:
+        assert (y1 - y0) * (x1 - x0) <= max_pixels
+        assert (y1 - y0) % align == 0 and (x1 - x0) % align == 0
+        assert 0 <= y0 < y1 <= h and 0 <= x0 < x1 <= w
+        rows.update(range(y0, y1))
+        cols.update(range(x0, x1))
+    assert len(rows) == h and len(cols) == w
+    return boxes
+
+
+@pytest.mark.parametrize("h, w, max_pixels, align", [
+    (4096, 6144, 1024 * 1024, 32),
+    (2048, 1024, 600 * 600, 32),
+    (640, 640, 1024 * 1024, 32),
+])
+def test_tiles_stay_within_budget(h, w, max_pixels, align):
+    check_boxes(h, w, max_pixels, 128, align)
+
+
+@pytest.mark.parametrize("max_pixels, align", [(96 * 96, 32), (64 * 64, 32), (256 * 256, 64), (32 * 32, 32)])
+def test_small_budget_shrinks_halo(max_pixels, align):
+    side, halo = fit_tile(max_pixels, 128, align)
+    assert side - 2 * halo >= align
+    check_boxes(512, 768, max_pixels, 128, align)
+
+
+def test_budget_below_one_aligned_tile():
+    with pytest.raises(ValueError):
+        tile_boxes(256, 256, 31 * 31, 128, 32)
+
+
+class BlendModel:
+    """Stands in for RIFE: each output pixel is the endpoints' pixels blended at the timestep."""
+
+    def inference(self, img0, img1, scale=1.0, timestep=0.5):
+        return img0 + (img1 - img0) * timestep
+
+
+@pytest.mark.parametrize("arbitrary", [False, True])
+def test_tiled_batches_match_full_frame(arbitrary):
+    h, w, max_pixels = 224, 320, 128 * 128
+    assert len({(y1 - y0, x1 - x0) for y0, y1, x0, x1, _ in tile_boxes(h, w, max_pixels, 32, 32)}) > 1
+    torch.manual_seed(0)
+    frames = [torch.rand(1, 3, h, w) for _ in range(3)]
+    pairs = [(frames[0], frames[1], [0.25, 0.5, 0.75]), (frames[1], frames[2], [0.25, 0.5, 0.75])]
+    model = BlendModel()
+    full = interpolate_batched(model, pairs, 1.0, arbitrary, batch_size=4)
+    tiled = tiled_batched(model, pairs, 1.0, max_pixels, halo=32, arbitrary=arbitrary, batch_size=4,
+                          crops={}, keys=[(0, 1), (1, 2)])
+    for want, got in zip(full, tiled):
+        assert len(want) == len(got)
+        for a, b in zip(want, got):
+            assert b.shape == a.shape
+            assert torch.allclose(a, b, atol=1e-5)
@@ -0,0 +1,126 @@
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+from metrics import TILE_CACHE_LOOKUPS
+
+# Hits refresh a tile's LRU position at most this often, so reads rarely write
+TOUCH_INTERVAL = 60.0
+
+# Tiles dropped per eviction round once the store is over budget
+EVICT_BATCH = 256
+
+
+class TileCache:
+    """
+    Persistent store of WMS tile bytes shared by every process on the host.
+
+    One SQLite file per layer (MBTiles-style), each row keyed by the style
+    parameters that change the rendering, the acquisition timestamp and
+    z/x/y. Every layer file is kept under `max_bytes` by dropping its least
+    recently used tiles. Tiles stored with a `ttl` read as missing once it
+    has passed, for slots whose upstream images may still change.
+    """
+
+    def __init__(self, cache_dir, max_bytes):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self._ready = set()
+        self._lock = threading.Lock()
+
+    def _connect(self, layer):
+        path = self.cache_dir / f"{layer.replace('/', '_')}.sqlite3"
+        conn = sqlite3.connect(str(path), timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        with self._lock:
+            if layer not in self._ready:
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute("""
+                    CREATE TABLE IF NOT EXISTS tiles (
+                        styles      TEXT NOT NULL,
+                        scale_range TEXT NOT NULL,
+                        timestamp   TEXT NOT NULL,
+                        z           INTEGER NOT NULL,
+                        x           INTEGER NOT NULL,
+                        y           INTEGER NOT NULL,
+                        data        BLOB NOT NULL,
+                        size_bytes  INTEGER NOT NULL,
+                        last_access REAL NOT NULL,
+                        expires_at  REAL,
+                        PRIMARY KEY (styles, scale_range, timestamp, z, x, y)
+                    )
+                """)
+                columns = {row["name"] for row in conn.execute("PRAGMA table_info(tiles)")}
+                if "expires_at" not in columns:
+                    conn.execute("ALTER TABLE tiles ADD COLUMN expires_at REAL")
+                conn.execute("CREATE INDEX IF NOT EXISTS tiles_lru ON tiles (last_access)")
+                conn.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+                conn.execute("INSERT OR IGNORE INTO meta VALUES ('size_bytes', 0)")
+                self._ready.add(layer)
+        return conn
+
+    @staticmethod
+    def _key(wms_params, timestamp, tile):
+        return (wms_params["STYLES"], wms_params["COLORSCALERANGE"],
+                timestamp.strftime("%Y%m%d%H%M"), tile.z, tile.x, tile.y)
+
+    def get(self, wms_params, timestamp, tile):
+        """Cached bytes of `tile` at `timestamp` rendered with `wms_params`, or None."""
+        key = self._key(wms_params, timestamp, tile)
+        where = "styles = ? AND scale_range = ? AND timestamp = ? AND z = ? AND x = ? AND y = ?"
+        with self._connect(wms_params["LAYERS"]) as conn:
+            row = conn.execute(f"SELECT data, last_access, expires_at FROM tiles WHERE {where}", key).fetchone()
+            if row is not None and row["expires_at"] is not None and row["expires_at"] < time.time():
+                row = None
+            if row is not None and time.time() - row["last_access"] > TOUCH_INTERVAL:
+                conn.execute(f"UPDATE tiles SET last_access = ? WHERE {where}", (time.time(), *key))
+        TILE_CACHE_LOOKUPS.labels("hit" if row is not None else "miss").inc()
+        return row["data"] if row is not None else None
+
+    def put(self, wms_params, timestamp, tile, data, ttl=None):
+        """Store `tile`'s bytes; with `ttl`, only for that many seconds."""
+        conn = self._connect(wms_params["LAYERS"])
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            key = self._key(wms_params, timestamp, tile)
+            old = conn.execute(
+                "SELECT size_bytes FROM tiles WHERE styles = ? AND scale_range = ? AND timestamp = ? "
+                "AND z = ? AND x = ? AND y = ?", key
+            ).fetchone()
+            now = time.time()
+            conn.execute("INSERT OR REPLACE INTO tiles VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                         (*key, data, len(data), now, now + ttl if ttl is not None else None))
+            conn.execute("UPDATE meta SET value = value + ? WHERE name = 'size_bytes'",
+                         (len(data) - (old["size_bytes"] if old is not None else 0),))
+            self._evict(conn)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def _evict(self, conn):
+        """Drop least recently used tiles until the layer fits `max_bytes`."""
+        while conn.execute("SELECT value FROM meta WHERE name = 'size_bytes'").fetchone()[0] > self.max_bytes:
+            freed = conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size_bytes), 0) FROM "
+                "(SELECT size_bytes FROM tiles ORDER BY last_access LIMIT ?)", (EVICT_BATCH,)
+            ).fetchone()
+            if freed[0] == 0:
+                return
+            conn.execute("DELETE FROM tiles WHERE rowid IN "
+                         "(SELECT rowid FROM tiles ORDER BY last_access LIMIT ?)", (EVICT_BATCH,))
+            conn.execute("UPDATE meta SET value = value - ? WHERE name = 'size_bytes'", (freed[1],))
+
+    def stats(self):
+        """Tile count and bytes per layer file."""
+        stats = {}
+        for path in sorted(self.cache_dir.glob("*.sqlite3")):
+            with self._connect(path.stem) as conn:
+                tiles = conn.execute("SELECT COUNT(*) FROM tiles").fetchone()[0]
+                size = conn.execute("SELECT value FROM meta WHERE name = 'size_bytes'").fetchone()[0]
+            stats[path.stem] = {"tiles": tiles, "size_bytes": size, "max_bytes": self.max_bytes}
+        return stats
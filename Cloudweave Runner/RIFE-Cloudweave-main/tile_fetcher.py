@@ -0,0 +1,267 @@
+import asyncio
+import threading
+import time
+import uuid
+from collections import deque
+from urllib.parse import urlsplit
+
+import aiohttp
+
+from metrics import TILE_FETCH_SECONDS, TILE_HEDGES, UPSTREAM_FAST_FAILS, timed
+
+# Upstream answers worth another try, as with the old requests Retry adapter
+RETRY_STATUSES = {500, 502, 503, 504}
+
+# Back-off bounds, in seconds, while waiting for a slot from the shared upstream limiter
+LIMITER_POLL_MIN = 0.02
+LIMITER_POLL_MAX = 0.5
+
+
+class CircuitOpen(Exception):
+    """Raised without contacting a host that has recently been failing."""
+
+    def __init__(self, host):
+        super().__init__(f"{host} is unhealthy, not sending requests for now")
+        self.host = host
+
+
+class HostHealth:
+    """
+    Rolling latency percentiles and a circuit breaker for one upstream host.
+
+    Latencies are kept per request shape, since a 2048px metatile takes far
+    longer than a single tile. After `failure_threshold` failures in a row
+    the circuit opens for `cooldown` seconds. It is then half-open: one
+    request at a time goes out as a probe while the rest still fail fast,
+    and the circuit reopens at once if the probe fails too.
+    """
+
+    def __init__(self, window=256, min_samples=20, failure_threshold=8, cooldown=30.0):
+        self.window = window
+        self.min_samples = min_samples
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self._latencies = {}
+        self._failures = 0
+        self._open_until = 0.0
+        self._probing = False
+
+    def allow(self):
+        """
+        Whether a request may go out now: "probe" for the one request let
+        through while half-open, which must report back with `probed()`.
+        """
+        if time.monotonic() < self._open_until or self._probing:
+            return False
+        if self._failures >= self.failure_threshold:
+            self._probing = True
+            return "probe"
+        return True
+
+    def probed(self):
+        self._probing = False
+
+    def succeeded(self, shape, elapsed):
+        self._latencies.setdefault(shape, deque(maxlen=self.window)).append(elapsed)
+        self._failures = 0
+
+    def failed(self):
+        self._failures += 1
+        if self._failures >= self.failure_threshold:
+            self._open_until = time.monotonic() + self.cooldown
+
+    def p95(self, shape):
+        samples = self._latencies.get(shape)
+        if samples is None or len(samples) < self.min_samples:
+            return None
+        return sorted(samples)[int(len(samples) * 0.95)]
+
+
+class TileFetcher:
+    """
+    Process-wide asyncio HTTP client for WMS tiles.
+
+    An event loop in a daemon thread owns one keep-alive connection pool,
+    sized to `concurrency`, and a semaphore with the same limit shared by
+    every pipeline in the process. Synchronous callers schedule requests up
+    front with `submit` and collect them as concurrent.futures, so a whole
+    time window is in flight at once instead of one slot at a time.
+
+    A request still unanswered after its host's running p95 for that
+    request shape gets one hedged duplicate, and the first answer wins.
+    Hedges are capped at `hedge_ratio` of all requests and ride on the
+    original's local concurrency slot, but need an upstream slot of their
+    own from the limiter and are skipped when none is free. Hosts that keep failing are cut off by a
+    circuit breaker, so their requests fail fast with CircuitOpen.
+
+    With a `limiter` (an UpstreamLimiter), every attempt also holds one of
+    the slots shared by all processes, granted fairly between jobs.
+    """
+
+    def __init__(self, concurrency=64, timeout=30.0, connect_timeout=10.0, retries=3, backoff=0.3,
+                 hedge_ratio=0.05, limiter=None):
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.hedge_ratio = hedge_ratio
+        self.limiter = limiter
+        self._loop = None
+        self._session = None
+        self._semaphore = None
+        self._health = {}
+        self._requests = 0
+        self._hedges = 0
+        self._lock = threading.Lock()
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._loop is not None:
+                return
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name="tile-fetcher", daemon=True).start()
+            asyncio.run_coroutine_threadsafe(self._open(), loop).result()
+            self._loop = loop
+
+    async def _open(self):
+        connector = aiohttp.TCPConnector(
+            limit=self.concurrency, limit_per_host=self.concurrency,
+            keepalive_timeout=30, ttl_dns_cache=300
+        )
+        self._session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(total=self.timeout, sock_connect=self.connect_timeout)
+        )
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+
+    async def _once(self, url, params):
+        start = time.perf_counter()
+        with timed(TILE_FETCH_SECONDS):
+            async with self._session.get(url, params=params) as r:
+                r.raise_for_status()
+                body = await r.read()
+                return body, r.headers.get("Content-Type", ""), time.perf_counter() - start
+
+    async def _hedge_slot(self, host, job):
+        """An upstream slot for a hedge if one is free right now, else None; the hedge never waits."""
+        loop = asyncio.get_running_loop()
+        waiter_id = uuid.uuid4().hex
+        slot = await loop.run_in_executor(None, self.limiter.try_acquire, host, job, waiter_id)
+        if slot is None:
+            loop.run_in_executor(None, self.limiter.withdraw, waiter_id)
+        return slot
+
+    async def _hedged(self, url, params, health, shape, host, job):
+        self._requests += 1
+        start = time.perf_counter()
+        primary = asyncio.ensure_future(self._once(url, params))
+        delay = health.p95(shape)
+        if delay is None or self._hedges >= self.hedge_ratio * self._requests:
+            return await primary
+        done, _ = await asyncio.wait({primary}, timeout=delay)
+        if done:
+            return primary.result()
+
+        # the duplicate counts against the upstream's in-flight cap like any request
+        slot = await self._hedge_slot(host, job) if self.limiter is not None else None
+        if self.limiter is not None and slot is None:
+            TILE_HEDGES.labels("skipped").inc()
+            return await primary
+        self._hedges += 1
+        TILE_HEDGES.labels("sent").inc()
+        backup = asyncio.ensure_future(self._once(url, params))
+        pending = {primary, backup}
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is backup:
+                            TILE_HEDGES.labels("won").inc()
+                        # timed from the original request, so the p95 is not pulled down by hedges
+                        body, content_type, _ = task.result()
+                        return body, content_type, time.perf_counter() - start
+            # both failed; report the original request's error
+            return primary.result()
+        finally:
+            for task in pending:
+                task.cancel()
+            if slot is not None:
+                await asyncio.get_running_loop().run_in_executor(None, self.limiter.release, slot)
+
+    async def _upstream_slot(self, host, job):
+        loop = asyncio.get_running_loop()
+        waiter_id = uuid.uuid4().hex
+        delay = LIMITER_POLL_MIN
+        try:
+            while True:
+                woken = self.limiter.wakeups(host)
+                slot = await loop.run_in_executor(None, self.limiter.try_acquire, host, job, waiter_id)
+                if slot is not None:
+                    return slot
+                # retry as soon as a slot on the host is released, or after the backoff
+                deadline = loop.time() + delay
+                while loop.time() < deadline and self.limiter.wakeups(host) == woken:
+                    await asyncio.sleep(LIMITER_POLL_MIN)
+                delay = min(delay * 2, LIMITER_POLL_MAX)
+        except asyncio.CancelledError:
+            loop.run_in_executor(None, self.limiter.withdraw, waiter_id)
+            raise
+
+    async def _attempt(self, url, params, health, shape, host, job):
+        if self.limiter is None:
+            return await self._hedged(url, params, health, shape, host, job)
+        slot = await self._upstream_slot(host, job)
+        try:
+            return await self._hedged(url, params, health, shape, host, job)
+        finally:
+            await asyncio.get_running_loop().run_in_executor(None, self.limiter.release, slot)
+
+    async def _get(self, url, params, job):
+        host = urlsplit(url).netloc
+        health = self._health.setdefault(host, HostHealth())
+        shape = (params.get("WIDTH"), params.get("HEIGHT"))
+        async with self._semaphore:
+            for attempt in range(self.retries + 1):
+                admitted = health.allow()
+                if not admitted:
+                    UPSTREAM_FAST_FAILS.labels(host).inc()
+                    raise CircuitOpen(host)
+                try:
+                    result = await self._attempt(url, params, health, shape, host, job)
+                    health.succeeded(shape, result[2])
+                    return result
+                except aiohttp.ClientResponseError as e:
+                    # a 4xx says the request is wrong, not that the host is unwell
+                    if e.status not in RETRY_STATUSES:
+                        raise
+                    health.failed()
+                    if attempt == self.retries:
+                        raise
+                except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+                    health.failed()
+                    if attempt == self.retries:
+                        raise
+                finally:
+                    if admitted == "probe":
+                        health.probed()
+                await asyncio.sleep(self.backoff * 2 ** attempt)
+
+    def submit(self, url, params, job="default"):
+        """
+        Schedule a GET on behalf of `job`; returns a concurrent.futures.Future
+        of (body, content_type, seconds the answering attempt took, counted
+        from its original request when a hedge answered).
+        Cancelling the future drops the request, queued or in flight.
+        """
+        self._ensure_started()
+        return asyncio.run_coroutine_threadsafe(self._get(url, params, job), self._loop)
+
+    def close(self):
+        with self._lock:
+            if self._loop is None:
+                return
+            asyncio.run_coroutine_threadsafe(self._session.close(), self._loop).result()
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._loop = None
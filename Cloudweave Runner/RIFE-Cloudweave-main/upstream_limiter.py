@@ -0,0 +1,161 @@
+import os
+import sqlite3
+import time
+import uuid
+from pathlib import Path
+from urllib.parse import quote
+
+# A waiting request that has not polled for this long belongs to a dead process
+WAITER_TTL = 5.0
+
+
+def fair_shares(capacity, demands):
+    """
+    Max-min fair split of `capacity` between jobs wanting `demands[job]`
+    slots: nobody gets more than it wants, and what a small job leaves
+    over is shared among the rest.
+    """
+    shares = {}
+    remaining = float(capacity)
+    jobs = sorted(demands, key=demands.get)
+    for i, job in enumerate(jobs):
+        shares[job] = min(float(demands[job]), remaining / (len(jobs) - i))
+        remaining -= shares[job]
+    return shares
+
+
+class UpstreamLimiter:
+    """
+    Caps requests in flight to each upstream host, and the rate at which
+    they start, across every process sharing one SQLite file.
+
+    In-flight requests hold a leased slot; the start rate is a token bucket
+    of `rate` per second holding up to `burst` tokens. The in-flight cap is
+    split max-min fairly between the jobs currently using or waiting for the
+    host, so a lone job can use all of it and a second job promptly gets
+    half. Slots of a process that died lapse after `lease_seconds`.
+
+    Waiting requests check with a read-only query first and only take the
+    write lock when a slot looks free, or to renew their place in the
+    queue, so they do not fight over it just to keep waiting. Releasing a
+    slot touches a per-host wake file whose `wakeups(host)` stamp waiters
+    can watch to retry at once instead of on their next backoff.
+    """
+
+    def __init__(self, db_path, max_in_flight=32, rate=50.0, burst=None, lease_seconds=120.0):
+        self.db_path = str(db_path)
+        self.max_in_flight = max_in_flight
+        self.rate = rate
+        self.burst = burst if burst is not None else rate
+        self.lease_seconds = lease_seconds
+        self.wake_dir = Path(os.path.abspath(self.db_path)).parent / "upstream-wake"
+        self.wake_dir.mkdir(parents=True, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS slots (
+                    id          TEXT PRIMARY KEY,
+                    host        TEXT NOT NULL,
+                    job         TEXT NOT NULL,
+                    acquired_at REAL NOT NULL
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS waiters (
+                    id      TEXT PRIMARY KEY,
+                    host    TEXT NOT NULL,
+                    job     TEXT NOT NULL,
+                    seen_at REAL NOT NULL
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS buckets (
+                    host       TEXT PRIMARY KEY,
+                    tokens     REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+            """)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _grant(self, conn, host, job, now, waiting):
+        """Tokens in `host`'s bucket, and whether a request of `job` may start there now."""
+        bucket = conn.execute("SELECT tokens, updated_at FROM buckets WHERE host = ?", (host,)).fetchone()
+        tokens = self.burst if bucket is None else \
+            min(self.burst, bucket["tokens"] + (now - bucket["updated_at"]) * self.rate)
+
+        demands, in_flight = {}, {}
+        for row in conn.execute("SELECT job, COUNT(*) AS n FROM slots WHERE host = ? AND acquired_at >= ? "
+                                "GROUP BY job", (host, now - self.lease_seconds)):
+            in_flight[row["job"]] = row["n"]
+            demands[row["job"]] = row["n"]
+        for row in conn.execute("SELECT job, COUNT(*) AS n FROM waiters WHERE host = ? AND seen_at >= ? "
+                                "GROUP BY job", (host, now - WAITER_TTL)):
+            demands[row["job"]] = demands.get(row["job"], 0) + row["n"]
+        if not waiting:
+            demands[job] = demands.get(job, 0) + 1
+        share = fair_shares(self.max_in_flight, demands)[job]
+        return tokens, tokens >= 1 and sum(in_flight.values()) < self.max_in_flight and in_flight.get(job, 0) < share
+
+    def try_acquire(self, host, job, waiter_id):
+        """
+        Take a slot for one request of `job` to `host` if its share and the
+        bucket allow it, returning the slot id; otherwise register the
+        request as waiting under `waiter_id` and return None.
+        """
+        now = time.time()
+        with self._connect() as conn:
+            row = conn.execute("SELECT seen_at FROM waiters WHERE id = ?", (waiter_id,)).fetchone()
+            registered = row is not None and row["seen_at"] >= now - WAITER_TTL / 2
+            _, free = self._grant(conn, host, job, now, registered)
+        if registered and not free:
+            return None
+
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            now = time.time()
+            conn.execute("DELETE FROM slots WHERE acquired_at < ?", (now - self.lease_seconds,))
+            conn.execute("DELETE FROM waiters WHERE seen_at < ?", (now - WAITER_TTL,))
+            conn.execute("INSERT OR REPLACE INTO waiters VALUES (?, ?, ?, ?)", (waiter_id, host, job, now))
+            tokens, free = self._grant(conn, host, job, now, True)
+
+            slot_id = None
+            if free:
+                slot_id = uuid.uuid4().hex
+                tokens -= 1
+                conn.execute("INSERT INTO slots VALUES (?, ?, ?, ?)", (slot_id, host, job, now))
+                conn.execute("DELETE FROM waiters WHERE id = ?", (waiter_id,))
+            conn.execute("INSERT OR REPLACE INTO buckets VALUES (?, ?, ?)", (host, tokens, now))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+        return slot_id
+
+    def _wake_path(self, host):
+        return self.wake_dir / (quote(host, safe="") + ".wake")
+
+    def wakeups(self, host):
+        """Stamp that changes whenever a slot on `host` is released."""
+        try:
+            return self._wake_path(host).stat().st_mtime_ns
+        except FileNotFoundError:
+            return 0
+
+    def withdraw(self, waiter_id):
+        """Forget a waiting request that gave up."""
+        with self._connect() as conn:
+            conn.execute("DELETE FROM waiters WHERE id = ?", (waiter_id,))
+
+    def release(self, slot_id):
+        with self._connect() as conn:
+            row = conn.execute("SELECT host FROM slots WHERE id = ?", (slot_id,)).fetchone()
+            conn.execute("DELETE FROM slots WHERE id = ?", (slot_id,))
+        if row is not None:
+            self._wake_path(row["host"]).touch()
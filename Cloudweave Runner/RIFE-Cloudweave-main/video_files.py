@@ -0,0 +1,69 @@
+import os
+import time
+from urllib.parse import quote
+
+from starlette.responses import FileResponse, Response
+from starlette.staticfiles import StaticFiles
+
+
+class VideoFiles(StaticFiles):
+    """
+    StaticFiles for finished videos, streamed from disk without copying.
+
+    Starlette already answers Range requests and sets ETag and Last-Modified,
+    answering revalidations with 304; this adds Cache-Control. A request
+    key's video is replaced whenever that request runs again, possibly with
+    new acquisitions in it, so by default clients revalidate every time.
+
+    With an `accel_prefix`, behind nginx, the body is left out and an
+    X-Accel-Redirect to `accel_prefix` + the file's relative path is returned
+    instead, so nginx sends the file itself with sendfile from the matching
+    internal location (see cloudweave.conf).
+    """
+
+    def __init__(self, *args, cache_control="no-cache", accel_prefix=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.cache_control = cache_control
+        self.accel_prefix = accel_prefix
+
+    def file_response(self, full_path, stat_result, scope, status_code=200):
+        response = super().file_response(full_path, stat_result, scope, status_code)
+        response.headers["Cache-Control"] = self.cache_control
+        if self.accel_prefix is None or not isinstance(response, FileResponse):
+            return response
+        relative = os.path.relpath(full_path, self.directory).replace(os.sep, "/")
+        return Response(status_code=status_code, media_type=response.media_type, headers={
+            "X-Accel-Redirect": self.accel_prefix + quote(relative),
+            "Cache-Control": self.cache_control,
+        })
+
+
+def prune_videos(directory, max_bytes, max_age, keep=()):
+    """
+    Delete the videos in `directory` last written more than `max_age`
+    seconds ago, then the oldest others until the rest take at most
+    `max_bytes`. Paths in `keep` are spared.
+    """
+    videos = []
+    for entry in os.scandir(directory):
+        if entry.name.endswith(".mp4") and entry.is_file():
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                # pruned by another worker meanwhile
+                continue
+            videos.append((stat.st_mtime, stat.st_size, entry.path))
+    videos.sort()
+    keep = {os.path.abspath(p) for p in keep}
+    total = sum(size for _, size, _ in videos)
+    now = time.time()
+    for mtime, size, path in videos:
+        if os.path.abspath(path) in keep:
+            continue
+        if now - mtime <= max_age and total <= max_bytes:
+            break
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+        total -= size
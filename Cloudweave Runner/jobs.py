@@ -0,0 +1,307 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import traceback
+import uuid
+from typing import Callable, Optional
+
+
+class JobStore:
+    """Durable job table shared by every uvicorn worker through one SQLite file."""
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id           TEXT PRIMARY KEY,
+                    status       TEXT NOT NULL,
+                    params       TEXT NOT NULL,
+                    result       TEXT,
+                    error        TEXT,
+                    attempts     INTEGER NOT NULL DEFAULT 0,
+                    created_at   REAL NOT NULL,
+                    started_at   REAL,
+                    finished_at  REAL,
+                    heartbeat_at REAL,
+                    dedupe_key   TEXT,
+                    cost         REAL NOT NULL DEFAULT 0
+                )
+            """)
+            columns = {row["name"] for row in conn.execute("PRAGMA table_info(jobs)")}
+            if "dedupe_key" not in columns:
+                conn.execute("ALTER TABLE jobs ADD COLUMN dedupe_key TEXT")
+            if "cost" not in columns:
+                conn.execute("ALTER TABLE jobs ADD COLUMN cost REAL NOT NULL DEFAULT 0")
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at)")
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_dedupe ON jobs (dedupe_key, status)")
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    @staticmethod
+    def _to_dict(row):
+        if row is None:
+            return None
+        job = dict(row)
+        job["params"] = json.loads(job["params"])
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        return job
+
+    def create(self, params: dict, result: Optional[dict] = None, dedupe_key: Optional[str] = None) -> str:
+        """Queue a job, or record it as already done when its `result` is known."""
+        job_id = str(uuid.uuid4())
+        now = time.time()
+        with self._connect() as conn:
+            if result is None:
+                conn.execute(
+                    "INSERT INTO jobs (id, status, params, created_at, dedupe_key) VALUES (?, 'queued', ?, ?, ?)",
+                    (job_id, json.dumps(params), now, dedupe_key)
+                )
+            else:
+                conn.execute(
+                    "INSERT INTO jobs (id, status, params, result, created_at, finished_at, dedupe_key) "
+                    "VALUES (?, 'done', ?, ?, ?, ?, ?)",
+                    (job_id, json.dumps(params), json.dumps(result), now, now, dedupe_key)
+                )
+        return job_id
+
+    def create_or_attach(self, params: dict, dedupe_key: str, cost: float = 0.0):
+        """
+        Queue a job of estimated `cost` CPU-seconds unless one with the same
+        `dedupe_key` is already queued or running. Returns (job_id, created).
+        """
+        conn = self._connect()
+        try:
+            # The write lock makes check-then-insert atomic across uvicorn workers
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT id FROM jobs WHERE dedupe_key = ? AND status IN ('queued', 'running') "
+                "ORDER BY created_at LIMIT 1",
+                (dedupe_key,)
+            ).fetchone()
+            if row is not None:
+                conn.execute("COMMIT")
+                return row["id"], False
+            job_id = str(uuid.uuid4())
+            conn.execute(
+                "INSERT INTO jobs (id, status, params, created_at, dedupe_key, cost) VALUES (?, 'queued', ?, ?, ?, ?)",
+                (job_id, json.dumps(params), time.time(), dedupe_key, cost)
+            )
+            conn.execute("COMMIT")
+            return job_id, True
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def get(self, job_id: str) -> Optional[dict]:
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._to_dict(row)
+
+    def claim(self, policy=None) -> Optional[dict]:
+        """
+        Atomically move the next queued job to running and return it.
+
+        With a scheduler CostPolicy, jobs go in its cost order and the front
+        one is held back until it fits next to the running ones; without,
+        oldest first.
+        """
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            now = time.time()
+            order, params = policy.order_by(now) if policy is not None else ("created_at", ())
+            row = conn.execute(f"SELECT * FROM jobs WHERE status = 'queued' ORDER BY {order} LIMIT 1",
+                               params).fetchone()
+            if row is not None and policy is not None:
+                running = conn.execute(
+                    "SELECT COUNT(*) AS n, COALESCE(SUM(cost), 0) AS cost FROM jobs "
+                    "WHERE status IN ('running', 'cancelling')"
+                ).fetchone()
+                if not policy.fits(running["n"], running["cost"], row["cost"]):
+                    row = None
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            conn.execute(
+                "UPDATE jobs SET status = 'running', attempts = attempts + 1, "
+                "started_at = ?, heartbeat_at = ? WHERE id = ?",
+                (now, now, row["id"])
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+        return self.get(row["id"])
+
+    def heartbeat(self, job_ids):
+        if not job_ids:
+            return
+        now = time.time()
+        with self._connect() as conn:
+            conn.executemany(
+                "UPDATE jobs SET heartbeat_at = ? WHERE id = ? AND status IN ('running', 'cancelling')",
+                [(now, job_id) for job_id in job_ids]
+            )
+
+    def finish(self, job_id: str, result: dict):
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = 'done', result = ?, finished_at = ? WHERE id = ?",
+                (json.dumps(result), time.time(), job_id)
+            )
+
+    def fail(self, job_id: str, error: str):
+        """Record a failure; a job that was asked to stop ends as cancelled instead."""
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = CASE status WHEN 'cancelling' THEN 'cancelled' ELSE 'failed' END, "
+                "error = ?, finished_at = ? WHERE id = ?",
+                (error, time.time(), job_id)
+            )
+
+    def expire(self, dedupe_key: str):
+        """Mark the finished jobs for `dedupe_key` expired once their output has been deleted."""
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = 'expired', result = NULL WHERE dedupe_key = ? AND status = 'done'",
+                (dedupe_key,)
+            )
+
+    def request_cancel(self, job_id: str) -> Optional[str]:
+        """
+        Cancel a queued job outright, or flag a running one so its worker stops
+        at the next check. Returns the resulting status, None for unknown ids.
+        """
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = 'cancelled', finished_at = ? WHERE id = ? AND status = 'queued'",
+                (now, job_id)
+            )
+            conn.execute(
+                "UPDATE jobs SET status = 'cancelling' WHERE id = ? AND status = 'running'",
+                (job_id,)
+            )
+            row = conn.execute("SELECT status FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return row["status"] if row is not None else None
+
+    def cancel_requested(self, job_id: str) -> bool:
+        with self._connect() as conn:
+            row = conn.execute("SELECT status FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return row is not None and row["status"] == "cancelling"
+
+    def requeue_stale(self, lease_seconds: float, max_attempts: int):
+        """Give jobs whose worker died (no heartbeat within the lease) back to the queue."""
+        cutoff = time.time() - lease_seconds
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = 'cancelled', finished_at = ? "
+                "WHERE status = 'cancelling' AND heartbeat_at < ?",
+                (time.time(), cutoff)
+            )
+            conn.execute(
+                "UPDATE jobs SET status = 'failed', error = 'worker lost too many times', finished_at = ? "
+                "WHERE status = 'running' AND heartbeat_at < ? AND attempts >= ?",
+                (time.time(), cutoff, max_attempts)
+            )
+            conn.execute(
+                "UPDATE jobs SET status = 'queued' WHERE status = 'running' AND heartbeat_at < ?",
+                (cutoff,)
+            )
+
+    def queue_depth(self) -> int:
+        with self._connect() as conn:
+            return conn.execute("SELECT COUNT(*) FROM jobs WHERE status = 'queued'").fetchone()[0]
+
+    def backlog(self) -> dict:
+        """Estimated CPU-seconds and number of jobs, queued and running."""
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT CASE status WHEN 'queued' THEN 'queued' ELSE 'running' END AS state, "
+                "COUNT(*) AS n, COALESCE(SUM(cost), 0) AS cost FROM jobs "
+                "WHERE status IN ('queued', 'running', 'cancelling') GROUP BY state"
+            ).fetchall()
+        backlog = {"queued": 0, "queued_cost": 0.0, "running": 0, "running_cost": 0.0}
+        for row in rows:
+            backlog[row["state"]] = row["n"]
+            backlog[f"{row['state']}_cost"] = row["cost"]
+        return backlog
+
+
+class JobWorkerPool:
+    """
+    Bounded set of threads that claim jobs from a JobStore and run them through
+    `handler(job, cancel_requested)`, where `cancel_requested()` reports
+    whether the job has since been cancelled.
+    """
+
+    def __init__(self, store: JobStore, handler: Callable[[dict, Callable[[], bool]], dict], workers: int = 1,
+                 poll_interval: float = 1.0, lease_seconds: float = 60.0, max_attempts: int = 3, policy=None):
+        self.store = store
+        self.handler = handler
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.policy = policy
+        self._running = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._threads = []
+
+    def start(self):
+        for i in range(self.workers):
+            t = threading.Thread(target=self._work, name=f"job-worker-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+        t = threading.Thread(target=self._beat, name="job-heartbeat", daemon=True)
+        t.start()
+        self._threads.append(t)
+
+    def stop(self):
+        self._stop.set()
+
+    def _beat(self):
+        while not self._stop.wait(self.lease_seconds / 3):
+            with self._lock:
+                running = list(self._running)
+            try:
+                self.store.heartbeat(running)
+                self.store.requeue_stale(self.lease_seconds, self.max_attempts)
+            except sqlite3.Error as e:
+                print(f"Job heartbeat failed: {e}")
+
+    def _work(self):
+        while not self._stop.is_set():
+            try:
+                job = self.store.claim(self.policy)
+            except sqlite3.Error as e:
+                print(f"Failed to claim job: {e}")
+                job = None
+            if job is None:
+                self._stop.wait(self.poll_interval)
+                continue
+
+            with self._lock:
+                self._running.add(job["id"])
+            try:
+                result = self.handler(job, lambda: self.store.cancel_requested(job["id"]))
+                self.store.finish(job["id"], result)
+            except Exception as e:
+                traceback.print_exc()
+                self.store.fail(job["id"], str(e))
+            finally:
+                with self._lock:
+                    self._running.discard(job["id"])
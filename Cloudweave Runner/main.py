@@ -1,14 +1,48 @@
 import os
-import subprocess
+import sys
+import shutil
+from concurrent.futures import ThreadPoolExecutor
 from fastapi import FastAPI, HTTPException
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, Response
 from fastapi.staticfiles import StaticFiles
 from typing import Optional
 from pydantic import BaseModel
 from datetime import datetime
-import uuid
 import time
 from pyproj import Transformer
+from jobs import JobStore, JobWorkerPool
+from result_cache import ResultCache, cache_key
+
+# Directory layout, resolved from this file so the service does not depend on its cwd
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+RIFE_DIR = os.path.join(BASE_DIR, 'RIFE-Cloudweave')
+MODEL_DIR = os.path.join(RIFE_DIR, 'train_log')
+JOBS_DIR = os.path.join(BASE_DIR, 'jobs')
+JOBS_DB = os.path.join(JOBS_DIR, 'jobs.sqlite3')
+CACHE_DB = os.path.join(JOBS_DIR, 'cache.sqlite3')
+
+# The interpolation engine and frame fetcher live in the RIFE-Cloudweave folder
+sys.path.append(RIFE_DIR)
+from cancellation import CancelToken
+from cost import count_periods, estimate_cost
+from engine import get_engine, read_frame
+from frame_feed import FrameFeed
+from ffmpeg_pipe import FfmpegPipeWriter
+from sequencing import sequence_frames
+from metrics import QUEUE_DEPTH, render_latest, track_job
+from scheduler import CostPolicy, Saturated
+from get_wms_img import fetch_images
+
+# Interpolation jobs each uvicorn worker runs at once
+JOB_WORKERS = int(os.environ.get('CLOUDWEAVE_JOB_WORKERS', '1'))
+
+# Short HLS segments so the first one is published soon after interpolation starts
+HLS_SEGMENT_SECONDS = 2
+
+# Disk budget for finished outputs kept around for repeat requests
+CACHE_MAX_BYTES = int(os.environ.get('CLOUDWEAVE_CACHE_MAX_BYTES', str(20 * 1024 ** 3)))
 
 app = FastAPI()
 
@@ -46,171 +80,231 @@ transformer = Transformer.from_crs("EPSG:4326","EPSG:3857")
 async def main():
     return {"message": "Hello World"}
 
-@app.post("/interpolate")
-async def interpolate_video(params: InterpolationParams):
+def output_urls(job_id: str) -> dict:
+    # Known before the job runs, so clients can start polling the playlist straight away
+    return {
+        "output_video": f'/static/interpolated_videos_{job_id}/interpolated_{job_id}.mp4',
+        "hls_playlist": f'/static/interpolated_videos_{job_id}/hls/output.m3u8',
+        "hls_directory": f'/static/interpolated_videos_{job_id}/hls',
+        "unique_id": job_id,
+    }
+
+def run_interpolation(job: dict, cancel: CancelToken) -> dict:
+    params = InterpolationParams(**job["params"])
+    job_id = job["id"]
+
+    # An identical job may have finished while this one sat in the queue
+    key = cache_key(job["params"], get_engine(MODEL_DIR).version)
+    cached = result_cache.lookup(key, record=False)
+    if cached is not None:
+        return cached
+
+    # Every job gets its own scratch directory so concurrent jobs never share frames
+    scratch_dir = os.path.join(JOBS_DIR, job_id)
+    input_frames_dir = os.path.join(scratch_dir, 'input_frames')
+    if os.path.exists(scratch_dir):
+        # Left over from an attempt that died mid-run
+        shutil.rmtree(scratch_dir)
+    os.makedirs(input_frames_dir)
+
+    output_folder = os.path.join('static', f'interpolated_videos_{job_id}')
+    os.makedirs(output_folder, exist_ok=True)
+
     try:
-        # Validate input parameters
-        try:
-            start_time = datetime.fromisoformat(params.start_time.replace('Z', '+00:00'))
-            end_time = datetime.fromisoformat(params.end_time.replace('Z', '+00:00'))
-        except ValueError:
-            raise HTTPException(status_code=400, detail="Invalid datetime format")
-
-        # Get the directory of the current script
-        current_dir = os.path.dirname(os.path.abspath(__file__))
-
-        # Path to the RIFE-Cloudweave folder
-        rife_dir = os.path.join(current_dir, 'RIFE-Cloudweave')
-
-        # Ensure input_frames and vid_out directories exist and are clean
-        input_frames_dir = os.path.join(rife_dir, 'input_frames')
-        vid_out_dir = os.path.join(rife_dir, 'vid_out')
-
-        # Clean existing directories
-        for dir_path in [input_frames_dir, vid_out_dir]:
-            if os.path.exists(dir_path):
-                # Remove all files in the directory
-                for filename in os.listdir(dir_path):
-                    file_path = os.path.join(dir_path, filename)
-                    try:
-                        if os.path.isfile(file_path) or os.path.islink(file_path):
-                            os.unlink(file_path)
-                        elif os.path.isdir(file_path):
-                            import shutil
-                            shutil.rmtree(file_path)
-                    except Exception as e:
-                        print(f"Failed to delete {file_path}. Reason: {e}")
-            else:
-                # Create the directory if it doesn't exist
-                os.makedirs(dir_path)
-
-        # Create a unique output folder in the root directory
-        unique_id = str(uuid.uuid4())
-        output_folder = os.path.join('static', f'interpolated_videos_{unique_id}')
-        os.makedirs(output_folder, exist_ok=True)
-
-        # Construct command arguments
-        cmd_args = [
-            'python', 'inference_video.py',
-            '--img', 'input_frames/',
-            '--bbox', params.bbox,
-            '--width', str(params.width),
-            '--height', str(params.height),
-            '--start_time', params.start_time,
-            '--end_time', params.end_time,
-            '--exp', str(params.exp),
-            '--scale', str(params.scale),
-            '--ext', params.ext,
-        ]
-
-        # Optional parameters
-        if params.fps is not None:
-            cmd_args.extend(['--fps', str(params.fps)])
-        if params.png:
-            cmd_args.append('--png')
-
-        # Run the interpolation from the RIFE-Cloudweave directory
-        print("Starting interpolation process...")
-        start_time = time.time()
+        # Determine FPS (use default 24 if not specified)
+        fps = params.fps if params.fps is not None else 24
+
+        output_video_path = os.path.join(output_folder, f'interpolated_{job_id}.mp4')
+        hls_output_dir = os.path.join(output_folder, 'hls')
 
-        result = subprocess.run(
-            cmd_args,
-            cwd=rife_dir,  # Set working directory to RIFE-Cloudweave
-            capture_output=True,  # Capture output
-            timeout=1200,  # 20 minutes timeout
-            text=True
-        )
+        # Fetch the frames into the job's scratch directory in a separate thread, handing
+        # each one to the interpolator as soon as it is saved
+        print(f"[{job_id}] Fetching input frames and interpolating as they arrive...")
+        start_time = time.time()
+        feed = FrameFeed(cancel)
+
+        def feed_frame(path):
+            # frames are numbered by their slot, including slots the server had no image for
+            frame = read_frame(path)
+            if frame is not None:
+                feed.put((int(os.path.splitext(os.path.basename(path))[0]), frame))
+
+        def acquire():
+            try:
+                fetch_images(params.bbox, params.width, params.height, params.start_time, params.end_time,
+                             output_directory=input_frames_dir, cancel=cancel, on_frame=feed_frame)
+            except BaseException as e:
+                feed.close(error=e)
+                raise
+            feed.close()
+
+        # Interpolate in-process and pipe raw frames into one ffmpeg that writes MP4 and HLS together
+        engine = get_engine(MODEL_DIR)
+        with ThreadPoolExecutor(max_workers=1, thread_name_prefix=f'fetch-{job_id[:8]}') as pool:
+            fetching = pool.submit(acquire)
+            try:
+                # Blank and repeated frames are skipped and the gaps they leave bridged
+                # at the slot cadence, so the video keeps a steady pace
+                frames = engine.interpolate_timed(sequence_frames(feed), 1, exp=params.exp,
+                                                  scale=params.scale, cancel=cancel)
+                with FfmpegPipeWriter(output_video_path, fps, hls_dir=hls_output_dir,
+                                      hls_time=HLS_SEGMENT_SECONDS, hls_event=True) as writer:
+                    for frame in frames:
+                        writer.write(frame)
+            except BaseException:
+                # Stop fetching frames nobody will use
+                cancel.cancel()
+                raise
+            fetching.result()
 
         end_time = time.time()
-        print(f"Interpolation process completed in {end_time - start_time:.2f} seconds")
+        print(f"[{job_id}] Interpolation and encoding completed in {end_time - start_time:.2f} seconds")
 
-        # Check for errors
-        if result.returncode != 0:
-            print("Stderr:", result.stderr)
-            raise HTTPException(status_code=500, detail=f"Interpolation failed: {result.stderr}")
+        result = {
+            **output_urls(job_id),
+            "num_output_frames": writer.frames_written
+        }
+        result_cache.store(key, os.path.abspath(output_folder), result)
+        return result
+    except Exception:
+        # Cancelled or failed: drop the partial MP4/HLS output as well
+        shutil.rmtree(output_folder, ignore_errors=True)
+        raise
+    finally:
+        shutil.rmtree(scratch_dir, ignore_errors=True)
+
+
+def estimate_params(params: InterpolationParams) -> dict:
+    start = datetime.fromisoformat(params.start_time.replace('Z', '+00:00'))
+    end = datetime.fromisoformat(params.end_time.replace('Z', '+00:00'))
+    # One GetMap per frame; fetch_images stops before the frame at end_time
+    periods = max(count_periods(start, end) - 1, 0)
+    return estimate_cost(1, periods, params.exp, params.width * params.height)
+
+
+def check_admission(cost: float) -> dict:
+    """Backlog the job would join; 429 with Retry-After when that is already too long."""
+    try:
+        return cost_policy.admit(job_store.backlog(), cost)
+    except Saturated as e:
+        raise HTTPException(status_code=429, detail="Too many queued jobs, retry later",
+                            headers={"Retry-After": str(e.retry_after)})
 
-        # Find the output frames
-        output_frames = sorted([f for f in os.listdir(vid_out_dir) if f.endswith('.png')])
 
-        if not output_frames:
-            raise HTTPException(status_code=404, detail="No output frames found")
+job_store = JobStore(JOBS_DB)
+# Same CPU budget, backlog limit and shortest-first order as the SSE backend's scheduler
+cost_policy = CostPolicy()
+# Jobs whose output gets evicted stop pointing at it
+result_cache = ResultCache(CACHE_DB, CACHE_MAX_BYTES, on_evict=job_store.expire)
+def handle_job(job: dict, cancel_requested) -> dict:
+    with track_job():
+        return run_interpolation(job, CancelToken(check=cancel_requested, interval=1.0))
 
-        # Prepare FFmpeg command to compile frames into video
-        output_video_path = os.path.join(output_folder, f'interpolated_{unique_id}.mp4')
 
-        # Determine FPS (use default 5 if not specified)
-        fps = params.fps if params.fps is not None else 24
+job_pool = JobWorkerPool(job_store, handle_job, workers=JOB_WORKERS, policy=cost_policy)
 
-        # FFmpeg command to convert frames to video
-        ffmpeg_cmd = [
-            'ffmpeg',
-            '-framerate', str(fps),
-            '-i', os.path.join(vid_out_dir, '%07d.png'),
-            '-c:v', 'libx264',
-            '-pix_fmt', 'yuv420p',
-            '-vf', "scale=ceil(iw/2)*2:ceil(ih/2)*2,lut=a='if(val<50,0,255)'",
-            output_video_path
-        ]
-
-        # Run FFmpeg
-        print("Starting video compilation...")
-        ffmpeg_start_time = time.time()
-        ffmpeg_result = subprocess.run(
-            ffmpeg_cmd,
-            capture_output=True,
-            text=True
-        )
-        ffmpeg_end_time = time.time()
-        print(f"Video compilation completed in {ffmpeg_end_time - ffmpeg_start_time:.2f} seconds")
-
-        # Check FFmpeg result
-        if ffmpeg_result.returncode != 0:
-            raise HTTPException(status_code=500, detail=f"Video compilation failed: {ffmpeg_result.stderr}")
-
-        # Create HLS stream
-        hls_output_dir = os.path.join(output_folder, 'hls')
-        os.makedirs(hls_output_dir, exist_ok=True)
-
-        # HLS conversion command
-        hls_cmd = [
-            'ffmpeg',
-            '-i', output_video_path,
-            '-start_number', '0',
-            '-hls_time', '10',
-            '-hls_list_size', '0',
-            '-f', 'hls',
-            '-vf', "scale=ceil(iw/2)*2:ceil(ih/2)*2,lut=a='if(val<50,0,255)'",
-            os.path.join(hls_output_dir, 'output.m3u8')
-        ]
-
-        # Run HLS conversion
-        print("Starting HLS conversion...")
-        hls_start_time = time.time()
-        hls_result = subprocess.run(
-            hls_cmd,
-            capture_output=True,
-            text=True
-        )
-        hls_end_time = time.time()
-        print(f"HLS conversion completed in {hls_end_time - hls_start_time:.2f} seconds")
-
-        # Check HLS conversion result
-        if hls_result.returncode != 0:
-            raise HTTPException(status_code=500, detail=f"HLS conversion failed: {hls_result.stderr}")
-
-        return {
-            "status": "success",
-            "output_video": f'/static/interpolated_videos_{unique_id}/interpolated_{unique_id}.mp4',
-            "output_frames_directory": vid_out_dir,
-            "hls_playlist": f'/static/interpolated_videos_{unique_id}/hls/output.m3u8',
-            "hls_directory": f'/static/interpolated_videos_{unique_id}/hls',
-            "unique_id": unique_id,
-            "num_output_frames": len(output_frames)
-        }
+@app.on_event("startup")
+async def start_job_workers():
+    # Load the model once per uvicorn worker before taking jobs
+    await run_in_threadpool(get_engine, MODEL_DIR)
+    job_pool.start()
+
+@app.on_event("shutdown")
+async def stop_job_workers():
+    job_pool.stop()
 
-    except Exception as e:
-        print(f"Error in interpolation: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
+@app.post("/interpolate", status_code=202)
+async def interpolate_video(params: InterpolationParams):
+    # Validate input parameters
+    try:
+        datetime.fromisoformat(params.start_time.replace('Z', '+00:00'))
+        datetime.fromisoformat(params.end_time.replace('Z', '+00:00'))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid datetime format")
+
+    try:
+        key = cache_key(params.dict(), get_engine(MODEL_DIR).version)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid bbox")
+    cached = await run_in_threadpool(result_cache.lookup, key)
+    if cached is not None:
+        job_id = await run_in_threadpool(job_store.create, params.dict(), cached, key)
+        return JSONResponse({
+            "status": "done",
+            "cached": True,
+            "job_id": job_id,
+            "status_url": f"/jobs/{job_id}",
+            **cached
+        })
+
+    cost = estimate_params(params)["cpu_seconds"]["total"]
+    await run_in_threadpool(check_admission, cost)
+
+    # Identical requests already queued or running share that job instead of starting another
+    job_id, created = await run_in_threadpool(job_store.create_or_attach, params.dict(), key, cost)
+    return {
+        "status": "queued" if created else "attached",
+        "cached": False,
+        "job_id": job_id,
+        "status_url": f"/jobs/{job_id}",
+        # EVENT playlist, published with its first segment and growing until the job is done
+        "hls_playlist": output_urls(job_id)["hls_playlist"]
+    }
+
+@app.post("/estimate")
+async def estimate(params: InterpolationParams):
+    """Dry run: the estimated cost of a job and whether it would be admitted now."""
+    try:
+        estimate = estimate_params(params)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid datetime format")
+    try:
+        admission = {"admitted": True, **await run_in_threadpool(check_admission, estimate["cpu_seconds"]["total"])}
+    except HTTPException as e:
+        admission = {"admitted": False, "retry_after": int(e.headers["Retry-After"])}
+    return {**estimate, "admission": admission}
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = await run_in_threadpool(job_store.get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    response = {
+        "job_id": job["id"],
+        "status": job["status"],
+        "created_at": job["created_at"],
+        "started_at": job["started_at"],
+        "finished_at": job["finished_at"],
+    }
+    if job["result"] is not None:
+        response.update(job["result"])
+    elif job["status"] in ("queued", "running"):
+        response["hls_playlist"] = output_urls(job["id"])["hls_playlist"]
+        response["hls_ready"] = os.path.exists(
+            os.path.join('static', f'interpolated_videos_{job["id"]}', 'hls', 'output.m3u8'))
+    elif job["status"] == "expired":
+        response["detail"] = "Output was evicted from the cache, submit the job again to render it"
+    if job["error"] is not None:
+        response["error"] = job["error"]
+    return response
+
+@app.delete("/jobs/{job_id}")
+async def cancel_job(job_id: str):
+    status = await run_in_threadpool(job_store.request_cancel, job_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return {"job_id": job_id, "status": status}
+
+@app.get("/cache/stats")
+async def cache_stats():
+    return await run_in_threadpool(result_cache.stats)
+
+@app.get("/metrics")
+async def metrics():
+    QUEUE_DEPTH.set(await run_in_threadpool(job_store.queue_depth))
+    body, content_type = await run_in_threadpool(render_latest)
+    return Response(body, media_type=content_type)
 
 # Health check endpoint
 @app.get("/health")
@@ -0,0 +1,149 @@
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import time
+from datetime import datetime, timezone
+from typing import Callable, Optional
+
+# Fields of InterpolationParams that change the rendered output
+CACHE_KEY_FIELDS = ("bbox", "width", "height", "start_time", "end_time", "exp", "scale", "fps")
+
+
+def _canonical_time(value: str) -> str:
+    dt = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt.astimezone(timezone.utc).isoformat()
+
+
+def cache_key(params: dict, model_version: str) -> str:
+    """Hash of the output-affecting parameters in a canonical form, plus the model version."""
+    canonical = {field: params.get(field) for field in CACHE_KEY_FIELDS}
+    canonical["bbox"] = [float(v) for v in str(params["bbox"]).split(",")]
+    canonical["start_time"] = _canonical_time(params["start_time"])
+    canonical["end_time"] = _canonical_time(params["end_time"])
+    canonical["scale"] = float(params["scale"])
+    canonical["model_version"] = model_version
+    blob = json.dumps(canonical, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(blob.encode()).hexdigest()
+
+
+def folder_size(path: str) -> int:
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+class ResultCache:
+    """
+    Finished interpolation outputs, keyed by `cache_key`.
+
+    Entries point at the job's static output folder. When the folders
+    together exceed `max_bytes`, the least recently used ones are deleted
+    and `on_evict(key)` is called, so whatever still hands out their URLs
+    can stop doing so. State lives in SQLite so every uvicorn worker shares
+    one view.
+    """
+
+    def __init__(self, db_path: str, max_bytes: int, on_evict: Optional[Callable[[str], None]] = None):
+        self.db_path = db_path
+        self.max_bytes = max_bytes
+        self.on_evict = on_evict
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS cache_entries (
+                    key         TEXT PRIMARY KEY,
+                    folder      TEXT NOT NULL,
+                    result      TEXT NOT NULL,
+                    size_bytes  INTEGER NOT NULL,
+                    created_at  REAL NOT NULL,
+                    last_access REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS cache_lru ON cache_entries (last_access)")
+            conn.execute("CREATE TABLE IF NOT EXISTS cache_stats (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+            conn.execute("INSERT OR IGNORE INTO cache_stats VALUES ('hits', 0), ('misses', 0), ('evictions', 0)")
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def lookup(self, key: str, record: bool = True) -> Optional[dict]:
+        """Return the cached result for `key`, or None; `record` counts the hit or miss."""
+        with self._connect() as conn:
+            row = conn.execute("SELECT folder, result FROM cache_entries WHERE key = ?", (key,)).fetchone()
+            removed = row is not None and not os.path.isdir(row["folder"])
+            if removed:
+                # Output removed behind our back
+                conn.execute("DELETE FROM cache_entries WHERE key = ?", (key,))
+                row = None
+            if row is not None:
+                conn.execute("UPDATE cache_entries SET last_access = ? WHERE key = ?", (time.time(), key))
+            if record:
+                conn.execute("UPDATE cache_stats SET value = value + 1 WHERE name = ?",
+                             ("hits" if row is not None else "misses",))
+        if removed and self.on_evict is not None:
+            self.on_evict(key)
+        return json.loads(row["result"]) if row is not None else None
+
+    def store(self, key: str, folder: str, result: dict):
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO cache_entries VALUES (?, ?, ?, ?, ?, ?)",
+                (key, folder, json.dumps(result), folder_size(folder), now, now)
+            )
+        self.evict()
+
+    def evict(self):
+        """Delete least recently used outputs until the cache fits its disk budget."""
+        while True:
+            conn = self._connect()
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                total = conn.execute("SELECT COALESCE(SUM(size_bytes), 0) FROM cache_entries").fetchone()[0]
+                victim = None
+                if total > self.max_bytes:
+                    victim = conn.execute(
+                        "SELECT key, folder FROM cache_entries ORDER BY last_access LIMIT 1"
+                    ).fetchone()
+                if victim is not None:
+                    conn.execute("DELETE FROM cache_entries WHERE key = ?", (victim["key"],))
+                    conn.execute("UPDATE cache_stats SET value = value + 1 WHERE name = 'evictions'")
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            finally:
+                conn.close()
+            if victim is None:
+                return
+            # Expire the URLs before the files go, so nobody is handed a path mid-delete
+            if self.on_evict is not None:
+                self.on_evict(victim["key"])
+            shutil.rmtree(victim["folder"], ignore_errors=True)
+
+    def stats(self) -> dict:
+        with self._connect() as conn:
+            counters = {row["name"]: row["value"] for row in conn.execute("SELECT * FROM cache_stats")}
+            entries, size = conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size_bytes), 0) FROM cache_entries"
+            ).fetchone()
+        lookups = counters["hits"] + counters["misses"]
+        return {
+            **counters,
+            "hit_ratio": counters["hits"] / lookups if lookups else 0.0,
+            "entries": entries,
+            "size_bytes": size,
+            "max_bytes": self.max_bytes,
+        }
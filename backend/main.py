@@ -1,5 +1,6 @@
 # backend/main.py
 
+import os
 import sys
 from pathlib import Path
 import uvicorn
@@ -12,14 +13,17 @@ RIFE_API  = REPO_ROOT / "Cloudweave Runner" / "RIFE-Cloudweave-main"
 sys.path.append(str(RIFE_API))
 
 # 2) import the FastAPI app you defined
-from get_wms_img_updated import app
+from get_wms_img_updated import VIDEOS_DIR, app
+from video_files import VideoFiles
 
-# 3) mount the videos directory first (so /videos is matched before /)
-VIDEOS_DIR = Path(__file__).parent / "videos"
+# 3) mount the videos directory first (so /videos is matched before /);
+#    behind nginx set CLOUDWEAVE_VIDEOS_ACCEL_PREFIX (see cloudweave.conf)
+#    so nginx sends the files itself
 VIDEOS_DIR.mkdir(exist_ok=True)
 app.mount(
     "/videos",
-    StaticFiles(directory=str(VIDEOS_DIR)),
+    VideoFiles(directory=str(VIDEOS_DIR),
+               accel_prefix=os.environ.get("CLOUDWEAVE_VIDEOS_ACCEL_PREFIX")),
     name="videos"
 )
 
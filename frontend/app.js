@@ -47,6 +47,11 @@ document.getElementById('start-btn').addEventListener('click', () => {
     const data = JSON.parse(e.data);
     progBar.style.width = data.progress + '%';
     progTxt.textContent = `${data.message} (${data.progress}%)`;
+    if (data.error) {
+      btn.disabled = false;
+      evtSrc.close();
+      return;
+    }
     if (data.video_url) {
       videoElt.src = data.video_url;
       videoElt.style.display = 'block';